@@ -1,23 +1,266 @@
-from langchain_community.utilities.tavily_search import TavilySearchAPIWrapper
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import Future
+import json
+import re
+import threading
+import time
+import httpx
+from langchain_community.utilities.tavily_search import TAVILY_API_URL, TavilySearchAPIWrapper
 from langchain_community.tools.tavily_search.tool import TavilySearchResults
 from langchain_groq import ChatGroq
 from langchain.agents import initialize_agent, AgentType
 import os
+from log import get_logger
+from metrics import record_cache_lookup
+from rate_limit import GROQ_EVENT_HOOKS
+
+logger = get_logger("agents")
 
 # Configuraciones de API
 groq_api_key = os.getenv("GROQ_API_KEY")
 tavily_api_key = os.getenv("TAVILY_API_KEY")
+TAVILY_API_URL = os.getenv("TAVILY_API_URL", TAVILY_API_URL)  # Permite apuntar a un servidor local
+
+# Pool de agentes reutilizables, indexado por (model_id, temperature)
+AGENT_POOL_SIZE = int(os.getenv("AGENT_POOL_SIZE", "8"))
+TAVILY_TIMEOUT = float(os.getenv("TAVILY_TIMEOUT", "30"))
+AGENT_TIMEOUT = float(os.getenv("AGENT_TIMEOUT", "90"))  # Tiempo máximo por ejecución del agente
+# Trazas de LangChain escritas con print() síncrono; las acciones ya se registran con el logger
+AGENT_VERBOSE = os.getenv("AGENT_VERBOSE", "false").lower() == "true"
+
+# Caché de resultados de búsqueda de Tavily
+TAVILY_CACHE_TTL = float(os.getenv("TAVILY_CACHE_TTL", "300"))
+TAVILY_CACHE_MAX_ENTRIES = int(os.getenv("TAVILY_CACHE_MAX_ENTRIES", "256"))
+
+_agent_pool = OrderedDict()
+_agent_pool_lock = threading.Lock()
+
+# Clientes HTTP compartidos para Tavily (keep-alive, sin handshake TLS por búsqueda)
+_tavily_http_client = httpx.Client(timeout=TAVILY_TIMEOUT)
+_tavily_async_http_client = None
+
+# Cliente HTTP asíncrono compartido por todos los ChatGroq del pool, con el limitador y las métricas de Groq
+_groq_async_http_client = httpx.AsyncClient(event_hooks=GROQ_EVENT_HOOKS)
+
+
+def _get_tavily_async_http_client():
+    global _tavily_async_http_client
+    if _tavily_async_http_client is None:
+        _tavily_async_http_client = httpx.AsyncClient(timeout=TAVILY_TIMEOUT)
+    return _tavily_async_http_client
+
+
+def normalize_query(query):
+    """Lowercase, collapse whitespace and drop trailing punctuation so equivalent queries share a key."""
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!.").strip().lower()
+
+
+class SearchResultCache:
+    """TTL cache of raw search results with in-flight de-duplication.
+
+    Concurrent lookups for the same key while a request is outstanding wait for
+    that request instead of sending their own. Entries expire after ttl seconds and
+    the least recently used one is dropped when max_entries is reached.
+    """
+
+    def __init__(self, ttl=TAVILY_CACHE_TTL, max_entries=TAVILY_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._async_inflight = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            record_cache_lookup("search", True)
+            return result
+
+    def put(self, key, result):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def fetch(self, key, fetch_fn):
+        """Return the cached result for key, or call fetch_fn once for all concurrent callers."""
+        result = self.get(key)
+        if result is not None:
+            return result
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+                self.misses += 1
+                record_cache_lookup("search", False)
+        if not owner:
+            return future.result()
+        try:
+            result = fetch_fn()
+            self.put(key, result)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    async def afetch(self, key, fetch_coro_fn):
+        """Async variant of fetch(); the shared request survives cancellation of any single caller."""
+        result = self.get(key)
+        if result is not None:
+            return result
+        task = self._async_inflight.get(key)
+        if task is None:
+            self.misses += 1
+            record_cache_lookup("search", False)
+            task = asyncio.ensure_future(fetch_coro_fn())
+            self._async_inflight[key] = task
+
+            def on_done(done_task):
+                self._async_inflight.pop(key, None)
+                if not done_task.cancelled() and done_task.exception() is None:
+                    self.put(key, done_task.result())
+
+            task.add_done_callback(on_done)
+        return await asyncio.shield(task)
+
+
+search_cache = SearchResultCache()
+
+
+class PooledTavilySearchAPIWrapper(TavilySearchAPIWrapper):
+    """Tavily wrapper that sends searches over shared keep-alive HTTP clients.
+
+    Results are served from search_cache when the same normalized query was
+    searched recently.
+    """
+
+    def _search_params(
+        self,
+        query,
+        max_results=5,
+        search_depth="advanced",
+        include_domains=None,
+        exclude_domains=None,
+        include_answer=False,
+        include_raw_content=False,
+        include_images=False,
+    ):
+        return {
+            "api_key": self.tavily_api_key.get_secret_value(),
+            "query": query,
+            "max_results": max_results,
+            "search_depth": search_depth,
+            "include_domains": include_domains or [],
+            "exclude_domains": exclude_domains or [],
+            "include_answer": include_answer,
+            "include_raw_content": include_raw_content,
+            "include_images": include_images,
+        }
+
+    @staticmethod
+    def _cache_key(params):
+        key_params = {k: v for k, v in params.items() if k != "api_key"}
+        key_params["query"] = normalize_query(key_params["query"])
+        return json.dumps(key_params, sort_keys=True)
+
+    def raw_results(self, query, *args, **kwargs):
+        params = self._search_params(query, *args, **kwargs)
+
+        def fetch():
+            response = _tavily_http_client.post(f"{TAVILY_API_URL}/search", json=params)
+            response.raise_for_status()
+            return response.json()
+
+        return search_cache.fetch(self._cache_key(params), fetch)
+
+    async def raw_results_async(self, query, *args, **kwargs):
+        params = self._search_params(query, *args, **kwargs)
+
+        async def fetch():
+            response = await _get_tavily_async_http_client().post(f"{TAVILY_API_URL}/search", json=params)
+            response.raise_for_status()
+            return response.json()
+
+        return await search_cache.afetch(self._cache_key(params), fetch)
+
 
 def create_tavily_agent(model_id, temperature=0.7):
     os.environ["TAVILY_API_KEY"] = tavily_api_key
 
-    llm = ChatGroq(model=model_id, temperature=temperature)
-    search = TavilySearchAPIWrapper()
+    llm = ChatGroq(model=model_id, temperature=temperature, http_async_client=_groq_async_http_client)
+    search = PooledTavilySearchAPIWrapper()
     tavily_tool = TavilySearchResults(api_wrapper=search)
     agent_chain = initialize_agent(
         [tavily_tool],
         llm,
         agent=AgentType.STRUCTURED_CHAT_ZERO_SHOT_REACT_DESCRIPTION,
-        verbose=True
+        verbose=AGENT_VERBOSE
     )
-    return agent_chain
\ No newline at end of file
+    return agent_chain
+
+
+def get_tavily_agent(model_id, temperature=0.7):
+    """Return a pooled agent chain for (model_id, temperature), building it on first use.
+
+    The chains keep no per-run state (no memory is attached), so the same chain can
+    serve concurrent requests. The least recently used chain is evicted when the pool
+    is full.
+    """
+    key = (model_id, temperature)
+    with _agent_pool_lock:
+        agent_chain = _agent_pool.get(key)
+        if agent_chain is not None:
+            _agent_pool.move_to_end(key)
+            return agent_chain
+
+    agent_chain = create_tavily_agent(model_id, temperature)
+
+    with _agent_pool_lock:
+        # Otro hilo pudo haber creado el mismo agente mientras tanto
+        agent_chain = _agent_pool.setdefault(key, agent_chain)
+        _agent_pool.move_to_end(key)
+        while len(_agent_pool) > AGENT_POOL_SIZE:
+            evicted_key, _ = _agent_pool.popitem(last=False)
+            logger.info("agent_evicted", model=evicted_key[0], temperature=evicted_key[1])
+    return agent_chain
+
+
+async def run_tavily_agent(agent_chain, user_input, on_action=None, timeout=AGENT_TIMEOUT):
+    """Run the agent through the async streaming interface and return its final output.
+
+    on_action is awaited with every AgentAction as the ReAct loop decides on it.
+    Raises asyncio.TimeoutError after timeout seconds; cancelling the calling task
+    cancels the in-flight LLM and search requests.
+    """
+    async def consume():
+        output = None
+        async for chunk in agent_chain.astream({"input": user_input}):
+            if on_action is not None:
+                for action in chunk.get("actions", []):
+                    await on_action(action)
+            if "output" in chunk:
+                output = chunk["output"]
+        return output
+
+    return await asyncio.wait_for(consume(), timeout=timeout)
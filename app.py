@@ -1,138 +1,245 @@
 import os
 from io import BytesIO
-import base64
-import requests
+import asyncio
+import time
+import httpx
 import chainlit as cl
-from chainlit.input_widget import Select
+from chainlit.config import config as chainlit_config
+from chainlit.input_widget import Select, Switch, Tags
 from dotenv import load_dotenv
-from groq import Groq
-from PIL import Image
-import pyheif
-from agents import create_tavily_agent
+from groq import APIStatusError, AsyncGroq, DefaultAsyncHttpxClient
+from cache import (
+    COMPLETION_CACHE_ENABLED,
+    SEMANTIC_CACHE_ENABLED,
+    completion_cache_key,
+    get_completion_cache,
+    is_text_only,
+    semantic_cache,
+)
+from benchmark import render_benchmark_table, render_session_summary, run_benchmark
+from audio import AUDIO_DECODER_AVAILABLE, StreamingTranscriber, normalize_audio
+from agents import AGENT_TIMEOUT, get_tavily_agent, run_tavily_agent
+from images import (
+    convert_heic_to_jpeg,
+    convert_png_to_jpeg,
+    encode_image,
+    image_cache,
+    image_cache_key,
+    max_image_edge,
+    run_image_job,
+)
+from log import get_logger
+from memory import ConversationMemory, fit_messages
+from metrics import (
+    METRICS_ENABLED,
+    STEP_DURATION,
+    TIME_TO_FIRST_TOKEN,
+    record_cache_lookup,
+    record_error,
+    record_token_usage,
+    start_metrics_server,
+)
+from rate_limit import GROQ_EVENT_HOOKS
+from resilience import call_with_failover
+from router import AUTO_MODEL_ID, route_model
+from streaming import consume_stream
 
 load_dotenv()
 
+logger = get_logger("app")
+
 # Groq API keys y configuración
 groq_api_key = os.getenv("GROQ_API_KEY")
-API_ENDPOINT = "https://api.groq.com/openai/v1/audio/transcriptions"
 TEXT_MODEL_ID = "llama-3.1-70b-versatile"  # Default text model ID
 VISION_MODEL_ID = "llama-3.2-11b-vision-preview"
 AUDIO_MODEL_ID = "whisper-large-v3"  # Audio model ID
-CURRENT_MODEL_ID = TEXT_MODEL_ID  # Default to text model on startup
-
-# Inicializar el cliente de Groq
-client = Groq(api_key=groq_api_key)
-session_context = {"text": None}
-use_tavily_agent = False  # Variable global para el agente
-
-def encode_image(image_path):
-    try:
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-            print("Image encoding to base64 successful")
-            return base64_image
-    except Exception as e:
-        print(f"Error encoding image: {e}")
-        return None
-
-def convert_heic_to_jpeg(heic_file_path):
-    try:
-        print(f"Converting HEIC file: {heic_file_path}")
-        heif_file = pyheif.read(heic_file_path)
-        image = Image.frombytes(
-            mode=heif_file.mode,
-            size=heif_file.size,
-            data=heif_file.data,
-            decoder_name="raw"
-        )
-
-        jpeg_bytes = BytesIO()
-        image.save(jpeg_bytes, format="JPEG")
-        jpeg_bytes.seek(0)
-        print("HEIC file conversion to JPEG successful")
-        base64_image = base64.b64encode(jpeg_bytes.read()).decode('utf-8')
-        print("JPEG file encoding to base64 successful")
-        return base64_image
-    except Exception as e:
-        print(f"Error converting HEIC to JPEG: {e}")
-        return None
-
-def convert_png_to_jpeg(png_file_path):
-    try:
-        print(f"Converting PNG file: {png_file_path}")
-        image = Image.open(png_file_path)
-        if image.mode in ('RGBA', 'P'):
-            image = image.convert('RGB')
-        jpeg_bytes = BytesIO()
-        image.save(jpeg_bytes, format="JPEG")
-        jpeg_bytes.seek(0)
-        print("PNG file conversion to JPEG successful")
-        base64_image = base64.b64encode(jpeg_bytes.read()).decode('utf-8')
-        print("JPEG file encoding to base64 successful")
-        return base64_image
-    except Exception as e:
-        print(f"Error converting PNG to JPEG: {e}")
-        return None
+TEXT_MODEL_IDS = [TEXT_MODEL_ID, "llama3-70b-8192", "llama3-8b-8192", "mixtral-8x7b-32768", "gemma-7b-it", "gemma2-9b-it"]
+
+# Pool de conexiones HTTP compartido por todas las sesiones
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "100"))
+GROQ_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GROQ_MAX_KEEPALIVE_CONNECTIONS", "20"))
+GROQ_KEEPALIVE_EXPIRY = float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "30"))
+GROQ_CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "5"))
+GROQ_READ_TIMEOUT = float(os.getenv("GROQ_READ_TIMEOUT", "60"))
+WHISPER_CONNECT_TIMEOUT = float(os.getenv("WHISPER_CONNECT_TIMEOUT", "5"))
+WHISPER_READ_TIMEOUT = float(os.getenv("WHISPER_READ_TIMEOUT", "30"))
+
+# HTTP/2 solo si el paquete h2 está instalado
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Inicializar el cliente asíncrono de Groq (no bloquea el event loop);
+# se comparte entre sesiones para chat, visión y transcripción
+client = AsyncGroq(
+    api_key=groq_api_key,
+    max_retries=0,  # Los reintentos los gestiona resilience.call_with_retries
+    http_client=DefaultAsyncHttpxClient(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=GROQ_MAX_CONNECTIONS,
+            max_keepalive_connections=GROQ_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=GROQ_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(GROQ_READ_TIMEOUT, connect=GROQ_CONNECT_TIMEOUT),
+        # Limitador por modelo (RPM/TPM) y métricas de tráfico para texto, visión y Whisper
+        event_hooks=GROQ_EVENT_HOOKS,
+    ),
+)
+# Ajustes de cada usuario, guardados en su sesión; estos son los valores iniciales
+DEFAULT_SETTINGS = {
+    "model": TEXT_MODEL_ID,  # Default to text model on startup
+    "vision_model": VISION_MODEL_ID,
+    "use_tavily_agent": False,
+    "stream_responses": True,  # Enviar los tokens a medida que llegan
+    "stream_transcription": True,  # Transcribir por segmentos mientras se graba
+    "cache_responses": COMPLETION_CACHE_ENABLED,  # Reutilizar respuestas idénticas (opcional)
+    "semantic_cache_responses": SEMANTIC_CACHE_ENABLED,  # Reutilizar respuestas a preguntas parecidas (opcional)
+    "concurrent_attachments": True,  # Procesar todos los adjuntos de un mensaje a la vez
+    "benchmark_mode": False,  # Enviar cada pregunta a varios modelos y comparar su velocidad
+    "benchmark_models": list(TEXT_MODEL_IDS),
+}
+ATTACHMENT_CONCURRENCY = int(os.getenv("ATTACHMENT_CONCURRENCY", "3"))
+
+if METRICS_ENABLED:
+    start_metrics_server()
+
+class MeteredStep(cl.Step):
+    """cl.Step that records its duration, by step name and model, in the metrics.
+
+    Errors are not counted here: an exception that leaves the step is counted once,
+    by the handler that catches it and tells the user.
+    """
+
+    def __init__(self, *args, model=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.model = model
+        self._started_at = None
+
+    async def __aenter__(self):
+        self._started_at = time.perf_counter()
+        return await super().__aenter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        STEP_DURATION.observe(time.perf_counter() - self._started_at, step=self.name, model=self.model or "")
+        return await super().__aexit__(exc_type, exc_val, exc_tb)
 
 async def process_uploaded_file(file):
-    async with cl.Step(name="File Reception", type="tool") as step:
+    async with MeteredStep(name="File Reception", type="tool") as step:
         step.input = f"File received: {file.name} with mime type {file.mime}"
-        print(step.input)
+        logger.info("step_input", step=step.name, input=step.input)
         if "image" in file.mime or file.mime == "application/octet-stream":
+            vision_model_id = get_setting("vision_model")
+            max_edge = max_image_edge(vision_model_id)
+            cache_key = await asyncio.to_thread(image_cache_key, file.path, max_edge)
+            base64_image = await asyncio.to_thread(image_cache.get, cache_key)
+            record_cache_lookup("image", base64_image is not None)
+            if base64_image is not None:
+                step.output = "Image already converted, served from cache"
+                logger.info("step_output", step=step.name, output=step.output)
+                return "image", base64_image
             if file.mime == "image/heic" or file.name.lower().endswith(".heic"):
-                async with cl.Step(name="Converting HEIC to JPEG", type="tool") as convert_step:
+                async with MeteredStep(name="Converting HEIC to JPEG", type="tool", model=vision_model_id) as convert_step:
                     convert_step.input = "Processing HEIC file..."
-                    print(convert_step.input)
-                    base64_image = convert_heic_to_jpeg(file.path)
+                    logger.info("step_input", step=convert_step.name, input=convert_step.input)
+                    base64_image = await run_image_job(convert_heic_to_jpeg, file.path, max_edge)
                     if base64_image is None:
                         raise ValueError("Conversion returned None")
+                    await asyncio.to_thread(image_cache.put, cache_key, base64_image)
                     convert_step.output = "HEIC converted and base64 encoded successfully"
-                    print(convert_step.output)
+                    logger.info("step_output", step=convert_step.name, output=convert_step.output)
                     return "image", base64_image
             elif file.mime == "image/png" or file.name.lower().endswith(".png"):
-                async with cl.Step(name="Converting PNG to JPEG", type="tool") as convert_step:
+                async with MeteredStep(name="Converting PNG to JPEG", type="tool", model=vision_model_id) as convert_step:
                     convert_step.input = "Processing PNG file..."
-                    print(convert_step.input)
-                    base64_image = convert_png_to_jpeg(file.path)
+                    logger.info("step_input", step=convert_step.name, input=convert_step.input)
+                    base64_image = await run_image_job(convert_png_to_jpeg, file.path, max_edge)
                     if base64_image is None:
                         raise ValueError("Conversion returned None")
+                    await asyncio.to_thread(image_cache.put, cache_key, base64_image)
                     convert_step.output = "PNG converted and base64 encoded successfully"
-                    print(convert_step.output)
+                    logger.info("step_output", step=convert_step.name, output=convert_step.output)
                     return "image", base64_image
             else:
-                async with cl.Step(name="Encoding Image to Base64", type="tool") as encode_step:
+                async with MeteredStep(name="Encoding Image to Base64", type="tool", model=vision_model_id) as encode_step:
                     encode_step.input = f"Processing {file.mime} file..."
-                    print(encode_step.input)
-                    base64_image = encode_image(file.path)
+                    logger.info("step_input", step=encode_step.name, input=encode_step.input)
+                    base64_image = await run_image_job(encode_image, file.path, max_edge)
                     if base64_image is None:
                         raise ValueError("Encoding returned None")
+                    await asyncio.to_thread(image_cache.put, cache_key, base64_image)
                     encode_step.output = f"{file.mime} converted and base64 encoded successfully"
-                    print(encode_step.output)
+                    logger.info("step_output", step=encode_step.name, output=encode_step.output)
                     return "image", base64_image
         elif "audio" in file.mime:
-            async with cl.Step(name="Processing Audio File", type="tool") as audio_step:
+            async with MeteredStep(name="Processing Audio File", type="tool") as audio_step:
                 audio_step.input = "Processing audio file..."
-                print(audio_step.input)
+                logger.info("step_input", step=audio_step.name, input=audio_step.input)
                 audio_buffer = BytesIO(file.get_raw_data())
                 audio_buffer.seek(0)
                 audio_file = audio_buffer.read()
                 audio_step.output = "Audio file processed successfully"
-                print(audio_step.output)
+                logger.info("step_output", step=audio_step.name, output=audio_step.output)
                 return "audio", audio_file
         step.output = "File type not supported"
-        print(step.output)
+        logger.info("step_output", step=step.name, output=step.output)
         return None, None
 
+def resolve_text_model(question, prompt_tokens=None):
+    """Return the selected text model, or route by prompt size when "Auto" is selected."""
+    model_id = get_setting("model")
+    if model_id != AUTO_MODEL_ID:
+        return model_id
+    model_id, reason = route_model(question, prompt_tokens)
+    logger.info("auto_model_routing", model=model_id, reason=reason)
+    return model_id
+
+def get_memory():
+    """Return the conversation history of the current user session."""
+    memory = cl.user_session.get("memory")
+    if memory is None:
+        memory = ConversationMemory()
+        cl.user_session.set("memory", memory)
+    return memory
+
+def get_setting(name):
+    """This user's value for a chat setting (see DEFAULT_SETTINGS)."""
+    settings = cl.user_session.get("settings") or DEFAULT_SETTINGS
+    return settings[name]
+
+def set_setting(name, value):
+    cl.user_session.set("settings", {**(cl.user_session.get("settings") or DEFAULT_SETTINGS), name: value})
+
+def apply_settings(settings: dict):
+    """Store the values of the chat settings widgets in this user's session and return them."""
+    session_settings = {
+        **DEFAULT_SETTINGS,
+        "model": settings["Model"],
+        "vision_model": settings["Vision Model"],
+        "use_tavily_agent": settings["use_agent"] == "Use AI Agent Current Events",
+        "stream_responses": settings.get("stream", True),
+        "stream_transcription": settings.get("stream_transcription", True),
+        "cache_responses": settings.get("cache_responses", COMPLETION_CACHE_ENABLED),
+        "semantic_cache_responses": settings.get("semantic_cache", SEMANTIC_CACHE_ENABLED),
+        "concurrent_attachments": settings.get("concurrent_attachments", True),
+        "benchmark_mode": settings.get("benchmark_mode", False),
+        "benchmark_models": [
+            model_id for model_id in settings.get("benchmark_models", TEXT_MODEL_IDS) if model_id in TEXT_MODEL_IDS
+        ],
+    }
+    cl.user_session.set("settings", session_settings)
+    return session_settings
+
 @cl.on_chat_start
 async def start():
-    global CURRENT_MODEL_ID, use_tavily_agent
-
     settings = await cl.ChatSettings(
         [
             Select(
                 id="Model",
                 label="Groq - Text Models",
-                values=[TEXT_MODEL_ID, "llama3-70b-8192", "llama3-8b-8192", "mixtral-8x7b-32768", "gemma-7b-it", "gemma2-9b-it"],
+                values=TEXT_MODEL_IDS + [AUTO_MODEL_ID],
                 initial_index=0,
             ),
             Select(
@@ -152,13 +259,49 @@ async def start():
                 label="Processing Mode",
                 values=["Use Only LLM", "Use AI Agent Current Events"],
                 initial_index=0
+            ),
+            Switch(
+                id="stream",
+                label="Stream Responses",
+                initial=True
+            ),
+            Switch(
+                id="stream_transcription",
+                label="Transcribe While Recording",
+                initial=True
+            ),
+            Switch(
+                id="cache_responses",
+                label="Cache Identical Prompts",
+                initial=COMPLETION_CACHE_ENABLED
+            ),
+            Switch(
+                id="semantic_cache",
+                label="Reuse Answers to Similar Questions",
+                initial=SEMANTIC_CACHE_ENABLED
+            ),
+            Switch(
+                id="concurrent_attachments",
+                label="Process Attachments Concurrently",
+                initial=True
+            ),
+            Switch(
+                id="benchmark_mode",
+                label="Benchmark Mode",
+                initial=False
+            ),
+            Tags(
+                id="benchmark_models",
+                label="Benchmark Models",
+                initial=list(TEXT_MODEL_IDS),
+                values=TEXT_MODEL_IDS
             )
         ]
     ).send()
 
-    CURRENT_MODEL_ID = settings["Model"]
-    use_tavily_agent = settings["use_agent"] == "Use AI Agent Current Events"
-    print(f"Initial settings - Model: {CURRENT_MODEL_ID}, Use Tavily Agent: {use_tavily_agent}")
+    session_settings = apply_settings(settings)
+    logger.info("initial_settings", **session_settings)
+    cl.user_session.set("memory", ConversationMemory())
 
     elements = [
         cl.Pdf(name="brochure", display="side", path="./docs/brochure.pdf"),
@@ -169,18 +312,119 @@ async def start():
 
 @cl.on_settings_update
 async def handle_settings_update(settings: dict):
-    global CURRENT_MODEL_ID, use_tavily_agent
-    print(f"Settings updated: {settings}")
-    CURRENT_MODEL_ID = settings["Model"]
-    use_tavily_agent = settings["use_agent"] == "Use AI Agent Current Events"
-    print(f"Updated settings - Model: {CURRENT_MODEL_ID}, Use Tavily Agent: {use_tavily_agent}")
+    logger.debug("settings_received", settings=settings)
+    session_settings = apply_settings(settings)
+    logger.info("settings_updated", **session_settings)
+
+async def create_chat_completion(**kwargs):
+    """Create a chat completion with retries, failing over along the model's fallback chain.
+
+    The history is cut to each candidate's context window, since a fallback can have
+    a much smaller one than the selected model. Returns (completion, model actually used).
+    """
+    return await call_with_failover(
+        lambda model_id: client.chat.completions.create(
+            **{**kwargs, "model": model_id, "messages": fit_messages(kwargs["messages"], model_id)}
+        ),
+        kwargs["model"],
+    )
+
+async def stream_completion(**kwargs):
+    """Stream a chat completion into a new message, recording TTFT and tokens/sec."""
+    msg = cl.Message(content="")
+    start_time = time.perf_counter()
+    stream, model_used = await create_chat_completion(stream=True, **kwargs)
+    stats, usage = await consume_stream(stream, start_time, on_token=msg.stream_token)
+    await msg.send()
+
+    stats["model"] = model_used
+    cl.user_session.set("last_response_stats", stats)
+    TIME_TO_FIRST_TOKEN.observe(stats["ttft"], model=model_used)
+    if usage:
+        record_token_usage(model_used, usage.prompt_tokens, usage.completion_tokens)
+    logger.info("streaming_stats", **stats)
+    return msg.content
+
+async def send_completion(**kwargs):
+    """Send a chat completion to the user, streaming tokens when enabled.
+
+    With the response cache on, identical text-only prompts are answered from the
+    cache without calling Groq. With the semantic cache on, the first question of a
+    conversation can also be answered from a close paraphrase asked earlier.
+    """
+    messages = kwargs["messages"]
+    model_id = kwargs["model"]
+    temperature = kwargs.get("temperature")
+    cache_key = None
+    if get_setting("cache_responses") and is_text_only(messages):
+        completion_cache = get_completion_cache()
+        cache_key = completion_cache_key(model_id, messages, temperature)
+        cached_response = await asyncio.to_thread(completion_cache.get, cache_key)
+        record_cache_lookup("completion", cached_response is not None)
+        if cached_response is not None:
+            logger.info("completion_cache_hit", **completion_cache.stats())
+            await cl.Message(content=cached_response).send()
+            return cached_response
+
+    # Solo preguntas sin historia: con contexto, la misma pregunta puede tener otra respuesta
+    question = None
+    if get_setting("semantic_cache_responses") and len(messages) == 1 and is_text_only(messages):
+        question = messages[0]["content"]
+        match = semantic_cache.lookup(model_id, question, temperature)
+        record_cache_lookup("semantic", match is not None)
+        if match is not None:
+            cached_response, similarity = match
+            logger.info("semantic_cache_hit", similarity=round(similarity, 3), **semantic_cache.stats())
+            await cl.Message(content=cached_response).send()
+            return cached_response
+
+    if get_setting("stream_responses"):
+        response_content = await stream_completion(**kwargs)
+    else:
+        chat_completion, model_used = await create_chat_completion(**kwargs)
+        response_content = chat_completion.choices[0].message.content
+        if chat_completion.usage:
+            record_token_usage(model_used, chat_completion.usage.prompt_tokens, chat_completion.usage.completion_tokens)
+        await cl.Message(content=response_content).send()
+
+    if cache_key is not None:
+        await asyncio.to_thread(get_completion_cache().put, cache_key, response_content)
+    if question is not None:
+        semantic_cache.add(model_id, question, response_content, temperature)
+    return response_content
+
+async def run_model_benchmark(prompt):
+    """Send prompt to every benchmark model at once and show a speed comparison table.
+
+    Each run is kept in the session so later runs can be compared with it.
+    """
+    benchmark_models = get_setting("benchmark_models")
+    if not benchmark_models:
+        await cl.Message(content="Select at least one model to benchmark.").send()
+        return
+    async with MeteredStep(name="Model Benchmark", type="llm") as step:
+        step.input = f"Benchmarking {', '.join(benchmark_models)}"
+        logger.info("step_input", step=step.name, input=step.input)
+        results = await run_benchmark(client, benchmark_models, prompt)
+        step.output = render_benchmark_table(results)
+        logger.info("benchmark_results", results=results)
+
+    runs = cl.user_session.get("benchmark_runs") or []
+    runs.append({"prompt": prompt, "results": results})
+    cl.user_session.set("benchmark_runs", runs)
+
+    content = f"**Benchmark run {len(runs)}**\n\n{step.output}"
+    if len(runs) > 1:
+        content += f"\n\n**Session average over {len(runs)} runs**\n\n{render_session_summary(runs)}"
+    await cl.Message(content=content).send()
 
 async def send_image_to_model(base64_image, user_message):
-    async with cl.Step(name="Send Image to Model", type="llm") as step:
+    vision_model_id = get_setting("vision_model")
+    async with MeteredStep(name="Send Image to Model", type="llm", model=vision_model_id) as step:
         step.input = "Sending image to vision model..."
-        print(step.input)
+        logger.info("step_input", step=step.name, input=step.input)
         try:
-            chat_completion = client.chat.completions.create(
+            response_content = await send_completion(
                 messages=[
                     {
                         "role": "user",
@@ -195,93 +439,146 @@ async def send_image_to_model(base64_image, user_message):
                         ],
                     }
                 ],
-                model=VISION_MODEL_ID,  # Use the vision model for image processing
+                model=vision_model_id,  # Use the vision model for image processing
             )
 
-            response_content = chat_completion.choices[0].message.content
-            # Store the response context in the session
-            session_context["vision"] = {"role": "assistant", "content": response_content}
+            # Store the analysis in the session history so text follow-ups can use it
+            get_memory().add_exchange(user_message, response_content)
 
             # Inform the user and reset to default text model
             await cl.Message(content="For the moment our vision model only allows for one analysis message per image.").send()
 
-            global CURRENT_MODEL_ID
-            CURRENT_MODEL_ID = TEXT_MODEL_ID
+            set_setting("model", TEXT_MODEL_ID)
 
             step.output = response_content
-            print(step.output)
+            logger.info("step_output", step=step.name, output=step.output)
             return response_content
         except Exception as e:
             error_message = f"Error sending image to model: {e}"
-            print(error_message)
+            logger.error("step_failed", step=step.name, error=error_message, exc_info=e)
+            record_error(step.name, e)
             step.output = error_message
             return None
 
+async def transcribe_audio(audio_file, filename='audio_temp.wav'):
+    transcription, _ = await call_with_failover(
+        lambda model_id: client.audio.transcriptions.create(
+            file=(filename, audio_file),
+            model=model_id,
+            response_format='text',
+            language='en',
+            timeout=httpx.Timeout(WHISPER_READ_TIMEOUT, connect=WHISPER_CONNECT_TIMEOUT),
+        ),
+        AUDIO_MODEL_ID,
+        endpoint="audio/transcriptions",
+    )
+    return transcription
+
+async def preprocess_audio(audio_file):
+    """Downmix, resample and compress the audio before it is uploaded to Whisper."""
+    if not AUDIO_DECODER_AVAILABLE:
+        return audio_file, 'audio_temp.wav'
+    async with MeteredStep(name="Audio Pre-processing", type="tool") as step:
+        step.input = f"Normalizing {len(audio_file)} bytes of audio to 16 kHz mono FLAC..."
+        logger.info("step_input", step=step.name, input=step.input)
+        try:
+            normalized_audio, filename, stats = await asyncio.to_thread(normalize_audio, audio_file)
+        except Exception as e:
+            step.output = f"Audio pre-processing skipped: {e}"
+            logger.info("step_output", step=step.name, output=step.output)
+            return audio_file, 'audio_temp.wav'
+        step.output = (
+            f"{stats['original_bytes']} -> {stats['normalized_bytes']} bytes "
+            f"({stats['reduction']:.0%} smaller) in {stats['processing_time'] * 1000:.0f} ms, "
+            f"estimated upload time saved: {stats['upload_time_saved'] * 1000:.0f} ms"
+        )
+        logger.info("step_output", step=step.name, output=step.output)
+        return normalized_audio, filename
+
 @cl.step(type="tool")
 async def speech_to_text(audio_file):
-    async with cl.Step(name="Speech to Text", type="tool") as step:
+    audio_file, filename = await preprocess_audio(audio_file)
+    async with MeteredStep(name="Speech to Text", type="tool", model=AUDIO_MODEL_ID) as step:
         step.input = "Processing audio to text..."
-        print(step.input)
+        logger.info("step_input", step=step.name, input=step.input)
         try:
-            headers = {
-                'Authorization': f'Bearer {groq_api_key}'
-            }
-            files = {
-                'file': ('audio_temp.wav', audio_file),
-                'model': (None, AUDIO_MODEL_ID),
-                'response_format': (None, 'text'),
-                'language': (None, 'en', 'es')
-            }
-
-            response = requests.post(API_ENDPOINT, headers=headers, files=files)
-            response.raise_for_status()  # Raise an error for bad status codes
-            step.output = response.text
-            print(step.output)
-            return response.text
-        except requests.exceptions.HTTPError as e:
+            transcription = await transcribe_audio(audio_file, filename)
+            step.output = transcription
+            logger.info("step_output", step=step.name, output=step.output)
+            return transcription
+        except APIStatusError as e:
             error_message = f"HTTP error occurred: {e}"
-            print(error_message)
+            logger.error("step_failed", step=step.name, error=error_message)
+            record_error(step.name, e)
             step.output = error_message
             return None
         except Exception as e:
             error_message = f"Error processing audio to text: {e}"
-            print(error_message)
+            logger.error("step_failed", step=step.name, error=error_message, exc_info=e)
+            record_error(step.name, e)
             step.output = error_message
             return None
 
 @cl.step(type="tool")
 async def generate_text_answer(transcription):
-    async with cl.Step(name="Generate Text Answer", type="tool") as step:
+    async with MeteredStep(name="Generate Text Answer", type="tool") as step:
         step.input = transcription
-        print(step.input)
+        logger.info("step_input", step=step.name, input=step.input)
         try:
-            global session_context
-            global CURRENT_MODEL_ID
-            messages = [{"role": "user", "content": transcription}]
-            response = client.chat.completions.create(
-                messages=messages, model=CURRENT_MODEL_ID, temperature=0.3
+            memory = get_memory()
+            model_id = resolve_text_model(transcription, memory.prompt_tokens(transcription))
+            step.model = model_id
+            response_content = await send_completion(
+                messages=memory.exchange_messages(model_id, transcription), model=model_id, temperature=0.3
             )
 
-            response_content = response.choices[0].message.content
-            # Store the response context in the session
-            session_context["text"] = {"role": "assistant", "content": response_content}
+            # Question and answer are stored together, after the await
+            memory.add_exchange(transcription, response_content)
             step.output = response_content
-            print(step.output)
+            logger.info("step_output", step=step.name, output=step.output)
             return response_content
         except Exception as e:
             error_message = f"Error generating text answer: {e}"
-            print(error_message)
+            logger.error("step_failed", step=step.name, error=error_message, exc_info=e)
+            record_error(step.name, e)
             step.output = error_message
             return None
 
 @cl.on_audio_chunk
 async def on_audio_chunk(chunk: cl.AudioChunk):
     audio_buffer = cl.user_session.get("audio_buffer")
-    if audio_buffer is None:
+    if chunk.isStart or audio_buffer is None:
         audio_buffer = BytesIO()
         cl.user_session.set("audio_buffer", audio_buffer)
+        # Una grabación anterior sin terminar libera su hilo de decodificación
+        transcriber = cl.user_session.get("transcriber")
+        if transcriber is not None:
+            transcriber.cancel()
+        transcriber = None
+        if get_setting("stream_transcription") and AUDIO_DECODER_AVAILABLE:
+            transcriber = StreamingTranscriber(
+                transcribe_audio, min_decibels=chainlit_config.features.audio.min_decibels
+            )
+        cl.user_session.set("transcriber", transcriber)
     audio_buffer.write(chunk.data)
 
+    # Los segmentos terminados se envían a Whisper mientras continúa la grabación
+    transcriber = cl.user_session.get("transcriber")
+    if transcriber is not None:
+        await transcriber.add_chunk(chunk.data)
+
+async def finish_streaming_transcription(transcriber):
+    async with MeteredStep(name="Speech to Text", type="tool", model=AUDIO_MODEL_ID) as step:
+        step.input = "Finishing streaming transcription..."
+        logger.info("step_input", step=step.name, input=step.input)
+        transcription = await transcriber.finish()
+        if transcription:
+            step.output = transcription
+        else:
+            step.output = "Streaming transcription failed, transcribing the whole recording."
+        logger.info("step_output", step=step.name, output=step.output)
+        return transcription
+
 @cl.on_audio_end
 async def on_audio_end():
     audio_buffer: BytesIO = cl.user_session.get("audio_buffer")
@@ -289,96 +586,162 @@ async def on_audio_end():
         await cl.Message(content="No audio buffer found.").send()
         return
 
-    audio_buffer.seek(0)
-    audio_file = audio_buffer.read()
+    transcription = None
+    transcriber = cl.user_session.get("transcriber")
+    if transcriber is not None:
+        cl.user_session.set("transcriber", None)
+        transcription = await finish_streaming_transcription(transcriber)
 
-    transcription = await speech_to_text(audio_file)
+    if not transcription:
+        audio_buffer.seek(0)
+        audio_file = audio_buffer.read()
+        transcription = await speech_to_text(audio_file)
 
     if transcription:
         await cl.Message(content=f"Transcription: {transcription}").send()
         text_answer = await generate_text_answer(transcription)
-        await cl.Message(content=text_answer).send()
+        if text_answer is None:
+            await cl.Message(content="Error generating text answer.").send()
         cl.user_session.set("audio_buffer", None)
     else:
         await cl.Message(content="Error in audio transcription.").send()
 
+async def handle_attachment(element, message):
+    """Decode one attachment and send it to its model; returns the file type."""
+    logger.info("attachment_received", name=element.name, mime=element.mime)
+    file_type, file_content = await process_uploaded_file(element)
+    if file_type == "image":
+        if file_content is None:
+            await cl.Message(content=f"Error processing image of type {element.mime}.").send()
+            return None
+        user_message = message.content.strip()
+        if not user_message:
+            user_message = "Can you analyze this image?"  # Fallback message if user doesn't provide one
+
+        chat_completion = await send_image_to_model(file_content, user_message)
+        if not chat_completion:
+            await cl.Message(content="Error analyzing the image.").send()
+    elif file_type == "audio":
+        transcription = await speech_to_text(file_content)
+
+        if transcription:
+            await cl.Message(content=f"Transcription: {transcription}").send()
+            text_answer = await generate_text_answer(transcription)
+            if text_answer is None:
+                await cl.Message(content="Error generating text answer.").send()
+        else:
+            await cl.Message(content="Error in audio transcription.").send()
+    return file_type
+
+async def handle_attachment_safely(element, message):
+    """handle_attachment() that reports a failure to the user instead of raising."""
+    try:
+        return await handle_attachment(element, message)
+    except Exception as e:
+        logger.error("attachment_failed", name=element.name, error=str(e))
+        record_error("Attachment", e)
+        await cl.Message(content=f"Error processing {element.name}.").send()
+        return None
+
+async def ask_vision_follow_up():
+    res = await cl.AskUserMessage(content="Would you like to continue with vision analysis or switch to text based conversations?", timeout=60, raise_on_timeout=False).send()
+    if res:
+        user_response = res['output'].strip().lower()
+        if "vision" in user_response:
+            await cl.Message(content="Please upload a new image.").send()
+        else:
+            set_setting("model", TEXT_MODEL_ID)
+            await cl.Message(content="Switching to text model.").send()
+    else:
+        set_setting("model", TEXT_MODEL_ID)
+        await cl.Message(content="No response received. Switching to text model.").send()
+
+async def process_attachments_concurrently(message):
+    """Handle all attachments at once, at most ATTACHMENT_CONCURRENCY at a time.
+
+    Each result is shown as soon as it is ready and the vision follow-up question
+    is asked once, after every attachment has finished.
+    """
+    semaphore = asyncio.Semaphore(ATTACHMENT_CONCURRENCY)
+
+    async def bounded(element):
+        async with semaphore:
+            return await handle_attachment_safely(element, message)
+
+    file_types = []
+    for finished in asyncio.as_completed([bounded(element) for element in message.elements]):
+        file_types.append(await finished)
+    if "image" in file_types:
+        await ask_vision_follow_up()
+
 @cl.on_message
 async def main(message: cl.Message):
-    global CURRENT_MODEL_ID, use_tavily_agent
-
-    print(f"Processing message: {message.content}")
-    print(f"Current settings - Model: {CURRENT_MODEL_ID}, Use Tavily Agent: {use_tavily_agent}")
+    logger.info(
+        "message_received",
+        content=message.content,
+        model=get_setting("model"),
+        use_tavily_agent=get_setting("use_tavily_agent"),
+    )
+
+    if get_setting("benchmark_mode") and not message.elements:
+        await run_model_benchmark(message.content)
+        return
 
-    if use_tavily_agent:
-        print("Activating Tavily Agent")
-        async with cl.Step(name="Tavily Agent Processing", type="tool") as step:
+    if get_setting("use_tavily_agent"):
+        async with MeteredStep(name="Tavily Agent Processing", type="tool") as step:
             step.input = message.content
-            print(f"Tavily Agent input: {step.input}")
+            logger.info("step_input", step=step.name, input=step.input)
             try:
-                agent_chain = create_tavily_agent(CURRENT_MODEL_ID)
-                response = agent_chain({"input": message.content})
-                step.output = response["output"]
-                print(f"Tavily Agent output: {step.output}")
+                step.model = resolve_text_model(message.content)
+                agent_chain = get_tavily_agent(step.model)
+
+                async def show_action(action):
+                    logger.info("agent_action", tool=action.tool, tool_input=action.tool_input)
+                    await step.stream_token(f"{action.tool}: {action.tool_input}\n")
+
+                step.output = await run_tavily_agent(agent_chain, message.content, on_action=show_action)
+                logger.info("step_output", step=step.name, output=step.output)
                 await cl.Message(content=step.output).send()
+            except asyncio.TimeoutError:
+                error_message = f"The Tavily Agent did not finish within {AGENT_TIMEOUT:.0f} seconds."
+                logger.error("step_failed", step=step.name, error=error_message)
+                record_error(step.name, "TimeoutError")
+                step.output = error_message
+                await cl.Message(content=error_message).send()
             except Exception as e:
                 error_message = f"Error processing with Tavily Agent: {str(e)}"
-                print(error_message)
+                logger.error("step_failed", step=step.name, error=error_message, exc_info=e)
+                record_error(step.name, e)
                 await cl.Message(content=error_message).send()
     else:
-        print("Using standard Groq processing")
         if not message.elements:
             # Process text message
-            if CURRENT_MODEL_ID is None:
+            if get_setting("model") is None:
                 await cl.Message(content="The model is not selected.").send()
                 return
 
-            messages = [{"role": "user", "content": message.content}]
-            chat_completion = client.chat.completions.create(
-                messages=messages,
-                model=CURRENT_MODEL_ID,
-            )
-            response_content = chat_completion.choices[0].message.content
-            await cl.Message(content=response_content).send()
+            memory = get_memory()
+            model_id = resolve_text_model(message.content, memory.prompt_tokens(message.content))
+            try:
+                response_content = await send_completion(
+                    messages=memory.exchange_messages(model_id, message.content),
+                    model=model_id,
+                )
+            except Exception as e:
+                error_message = f"Error generating text answer: {e}"
+                logger.error("step_failed", step="Text Answer", error=error_message, exc_info=e)
+                record_error("Text Answer", e)
+                await cl.Message(content=error_message).send()
+                return
+            memory.add_exchange(message.content, response_content)
         else:
-            for element in message.elements:
-                print(f"Processing element of type: {element.mime}")
-                file_type, file_content = await process_uploaded_file(element)
-                if file_type == "image":
-                    print("Image processed successfully.")
-                    if file_content is None:
-                        await cl.Message(content=f"Error processing image of type {element.mime}.").send()
-                        continue
-                    user_message = message.content.strip()
-                    if not user_message:
-                        user_message = "Can you analyze this image?"  # Fallback message if user doesn't provide one
-
-                    chat_completion = await send_image_to_model(file_content, user_message)
-                    if chat_completion:
-                        await cl.Message(content=chat_completion).send()
-                    else:
-                        await cl.Message(content="Error analyzing the image.").send()
-
-                    res = await cl.AskUserMessage(content="Would you like to continue with vision analysis or switch to text based conversations?", timeout=60, raise_on_timeout=False).send()
-                    if res:
-                        user_response = res['output'].strip().lower()
-                        if "vision" in user_response:
-                            await cl.Message(content="Please upload a new image.").send()
-                        else:
-                            CURRENT_MODEL_ID = TEXT_MODEL_ID
-                            await cl.Message(content="Switching to text model.").send()
-                    else:
-                        CURRENT_MODEL_ID = TEXT_MODEL_ID
-                        await cl.Message(content="No response received. Switching to text model.").send()
-                elif file_type == "audio":
-                    transcription = await speech_to_text(file_content)
-
-                    if transcription:
-                        await cl.Message(content=f"Transcription: {transcription}").send()
-                        text_answer = await generate_text_answer(transcription)
-                        await cl.Message(content=text_answer).send()
-                        session_context["text"] = None
-                    else:
-                        await cl.Message(content="Error in audio transcription.").send()
+            if get_setting("concurrent_attachments") and len(message.elements) > 1:
+                await process_attachments_concurrently(message)
+            else:
+                for element in message.elements:
+                    file_type = await handle_attachment_safely(element, message)
+                    if file_type == "image":
+                        await ask_vision_follow_up()
 
 if __name__ == "__main__":
-    print("Starting the application...")
\ No newline at end of file
+    logger.info("app_starting")
\ No newline at end of file
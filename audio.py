@@ -0,0 +1,288 @@
+import asyncio
+from collections import deque
+from io import BytesIO
+import os
+import threading
+import time
+from log import get_logger
+
+logger = get_logger("audio")
+
+# PyAV (ffmpeg) y numpy son opcionales: sin ellos se transcribe la grabación completa
+try:
+    import av
+    import numpy as np
+    AUDIO_DECODER_AVAILABLE = True
+except ImportError:
+    AUDIO_DECODER_AVAILABLE = False
+
+TARGET_SAMPLE_RATE = 16000  # Whisper trabaja internamente a 16 kHz mono
+# Ancho de banda de subida supuesto para estimar el tiempo ahorrado
+UPLOAD_BANDWIDTH_MBPS = float(os.getenv("UPLOAD_BANDWIDTH_MBPS", "10"))
+# Duración mínima de cada segmento enviado a Whisper mientras se graba: las frases cortas se
+# juntan con las siguientes para no agotar las peticiones por minuto (Groq factura al menos 10 s)
+STREAMING_MIN_SEGMENT_SECONDS = float(os.getenv("STREAMING_MIN_SEGMENT_SECONDS", "10"))
+DECODER_IDLE_TIMEOUT = 60  # Segundos sin datos tras los que una grabación se da por abandonada
+
+
+def decode_to_pcm(data, sample_rate=TARGET_SAMPLE_RATE):
+    """Decode any container ffmpeg understands (webm/opus, wav, mp3...) into mono 16-bit PCM.
+
+    A truncated stream is decoded up to its last complete packet.
+    """
+    container = av.open(BytesIO(data))
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=sample_rate)
+    pcm = []
+    try:
+        try:
+            for frame in container.decode(audio=0):
+                for resampled in resampler.resample(frame):
+                    pcm.append(resampled.to_ndarray().tobytes())
+        except (av.error.EOFError, av.error.InvalidDataError):
+            pass  # Último paquete incompleto
+        for resampled in resampler.resample(None):
+            pcm.append(resampled.to_ndarray().tobytes())
+    finally:
+        container.close()
+    return b"".join(pcm)
+
+
+def encode_flac(pcm, sample_rate=TARGET_SAMPLE_RATE):
+    """Encode mono 16-bit PCM as FLAC (lossless, roughly half the size of WAV)."""
+    flac_bytes = BytesIO()
+    container = av.open(flac_bytes, mode="w", format="flac")
+    stream = container.add_stream("flac", rate=sample_rate)
+    stream.layout = "mono"
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    frame = av.AudioFrame.from_ndarray(samples.reshape(1, -1), format="s16", layout="mono")
+    frame.sample_rate = sample_rate
+    for packet in stream.encode(frame):
+        container.mux(packet)
+    for packet in stream.encode(None):
+        container.mux(packet)
+    container.close()
+    return flac_bytes.getvalue()
+
+
+def normalize_audio(data):
+    """Downmix to mono, resample to 16 kHz and re-encode as FLAC before upload.
+
+    Returns (audio_bytes, filename, stats). Audio that is already smaller in its
+    original container (e.g. webm/opus from the browser recorder) is returned
+    unchanged; stats report the byte reduction and the estimated upload time saved.
+    """
+    start_time = time.perf_counter()
+    flac = encode_flac(decode_to_pcm(data))
+    processing_time = time.perf_counter() - start_time
+
+    use_flac = len(flac) < len(data)
+    saved_bytes = len(data) - len(flac) if use_flac else 0
+    stats = {
+        "original_bytes": len(data),
+        "normalized_bytes": len(flac) if use_flac else len(data),
+        "reduction": saved_bytes / len(data) if data else 0.0,
+        "processing_time": processing_time,
+        "upload_time_saved": saved_bytes * 8 / (UPLOAD_BANDWIDTH_MBPS * 1_000_000) - processing_time,
+    }
+    if use_flac:
+        return flac, "audio_temp.flac", stats
+    return data, "audio_temp.wav", stats
+
+
+class IncrementalDecoder:
+    """Decodes a recording that is still growing with one persistent demuxer and decoder.
+
+    feed() only appends bytes; a background thread reads them as they arrive, so each
+    chunk is decoded once instead of decoding the recording again from the start.
+    take_pcm() returns the mono 16-bit PCM decoded since the previous call. After
+    close(), join() waits for the end of the stream; error holds any decoding failure.
+    """
+
+    def __init__(self, sample_rate=TARGET_SAMPLE_RATE, idle_timeout=DECODER_IDLE_TIMEOUT):
+        self.sample_rate = sample_rate
+        self.idle_timeout = idle_timeout
+        self.error = None
+        self._data = bytearray()
+        self._closed = False
+        self._condition = threading.Condition()
+        self._pcm = []
+        self._pcm_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def feed(self, data):
+        with self._condition:
+            self._data += data
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def read(self, size=-1):
+        """File-like read for av.open(): blocks until bytes arrive or the stream is closed."""
+        with self._condition:
+            while not self._data and not self._closed:
+                if not self._condition.wait(self.idle_timeout):
+                    self._closed = True  # Grabación abandonada: se termina el hilo
+            end = len(self._data) if size < 0 else min(size, len(self._data))
+            chunk = bytes(self._data[:end])
+            del self._data[:end]
+            return chunk
+
+    def _run(self):
+        try:
+            container = av.open(self)
+            resampler = av.AudioResampler(format="s16", layout="mono", rate=self.sample_rate)
+            try:
+                try:
+                    for frame in container.decode(audio=0):
+                        self._append(resampler.resample(frame))
+                except (av.error.EOFError, av.error.InvalidDataError):
+                    pass  # Último paquete incompleto al detener la grabación
+                self._append(resampler.resample(None))
+            finally:
+                container.close()
+        except Exception as e:
+            self.error = e
+
+    def _append(self, frames):
+        pcm = b"".join(frame.to_ndarray().tobytes() for frame in frames)
+        if pcm:
+            with self._pcm_lock:
+                self._pcm.append(pcm)
+
+    def take_pcm(self):
+        with self._pcm_lock:
+            pcm, self._pcm = b"".join(self._pcm), []
+        return pcm
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+
+class SpeechSegmenter:
+    """Energy-based voice activity detector that cuts 16-bit mono PCM at silence boundaries.
+
+    A frame counts as speech when its RMS level is above min_decibels (dBFS, the same
+    scale as Chainlit's [features.audio] min_decibels). A segment is closed after
+    min_silence_ms of silence, provided it holds at least min_speech_ms of speech and
+    lasts min_segment_ms; shorter ones stay open and are joined with the next phrase,
+    without the silence in between.
+    """
+
+    def __init__(self, sample_rate=TARGET_SAMPLE_RATE, min_decibels=-45, frame_ms=30,
+                 min_silence_ms=500, min_speech_ms=300, preroll_ms=200,
+                 min_segment_ms=STREAMING_MIN_SEGMENT_SECONDS * 1000):
+        self.frame_bytes = sample_rate * frame_ms // 1000 * 2
+        self.min_decibels = min_decibels
+        self.min_silence_frames = max(1, min_silence_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.min_segment_bytes = int(sample_rate * min_segment_ms / 1000) * 2
+        self.preroll = deque(maxlen=max(1, preroll_ms // frame_ms))
+        self.pending = b""
+        self._reset()
+
+    def _reset(self):
+        self.segment = bytearray()
+        self.speech_frames = 0
+        self.silence_frames = 0
+
+    def _is_speech(self, frame):
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32) / 32768.0
+        rms = float(np.sqrt(np.mean(samples * samples)))
+        return 20 * np.log10(max(rms, 1e-10)) > self.min_decibels
+
+    def feed(self, pcm):
+        """Add PCM samples and return the list of segments closed by them."""
+        data = self.pending + pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self.pending = data[usable:]
+        segments = []
+        for offset in range(0, usable, self.frame_bytes):
+            frame = data[offset:offset + self.frame_bytes]
+            held = self.silence_frames >= self.min_silence_frames  # Segmento corto a la espera
+            if self._is_speech(frame):
+                if not self.segment or held:
+                    self.segment.extend(b"".join(self.preroll))
+                    self.preroll.clear()
+                self.segment.extend(frame)
+                self.speech_frames += 1
+                self.silence_frames = 0
+            elif self.segment and not held:
+                self.segment.extend(frame)
+                self.silence_frames += 1
+                if self.silence_frames >= self.min_silence_frames:
+                    if self.speech_frames < self.min_speech_frames:
+                        self._reset()  # Solo ruido
+                    elif len(self.segment) >= self.min_segment_bytes:
+                        segments.append(bytes(self.segment))
+                        self._reset()
+            else:
+                self.preroll.append(frame)
+        return segments
+
+    def flush(self):
+        """Return the segment still open at the end of the recording, if it holds speech."""
+        segment = None
+        if self.speech_frames >= self.min_speech_frames:
+            segment = bytes(self.segment) + self.pending
+        self.pending = b""
+        self.preroll.clear()
+        self._reset()
+        return segment
+
+
+class StreamingTranscriber:
+    """Transcribes a recording segment by segment while the user is still speaking.
+
+    transcribe is a coroutine function (audio_bytes, filename) -> text. Every finished
+    segment is sent to it right away; finish() waits for all of them and stitches the
+    partial transcripts in recording order.
+    """
+
+    def __init__(self, transcribe, min_decibels=-45):
+        self.transcribe = transcribe
+        self.decoder = IncrementalDecoder()
+        self.segmenter = SpeechSegmenter(min_decibels=min_decibels)
+        self.tasks = []
+
+    async def _transcribe_segment(self, pcm, filename):
+        return await self.transcribe(await asyncio.to_thread(encode_flac, pcm), filename)
+
+    def _send_segment(self, pcm):
+        filename = f"segment_{len(self.tasks)}.flac"
+        self.tasks.append(asyncio.create_task(self._transcribe_segment(pcm, filename)))
+
+    def _segment_decoded_pcm(self):
+        for segment in self.segmenter.feed(self.decoder.take_pcm()):
+            self._send_segment(segment)
+
+    async def add_chunk(self, data):
+        # La decodificación ocurre en el hilo del decoder; aquí solo se segmenta el PCM ya listo
+        self.decoder.feed(data)
+        self._segment_decoded_pcm()
+
+    async def finish(self):
+        """Return the stitched transcript, or None if any part could not be transcribed."""
+        self.decoder.close()
+        await asyncio.to_thread(self.decoder.join)
+        if self.decoder.error is not None:
+            logger.warning("streaming_decode_failed", error=str(self.decoder.error))
+            self.cancel()
+            return None
+        self._segment_decoded_pcm()
+        tail = self.segmenter.flush()
+        if tail:
+            self._send_segment(tail)
+
+        results = await asyncio.gather(*self.tasks, return_exceptions=True)
+        if not results or any(result is None or isinstance(result, BaseException) for result in results):
+            return None
+        return " ".join(text.strip() for text in results if text.strip())
+
+    def cancel(self):
+        self.decoder.close()
+        for task in self.tasks:
+            task.cancel()
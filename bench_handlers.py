@@ -0,0 +1,381 @@
+"""Offline benchmark of the Chainlit handlers against the stub Groq/Tavily server.
+
+Runs main() (text, image and agent paths) and on_audio_end() outside a browser
+session and reports p50/p95/p99 handler latency, throughput and peak RSS per
+workload. Nothing leaves the machine: every Groq, Whisper and Tavily request is
+served by stub_server.py.
+
+    python bench_handlers.py --iterations 30 --concurrency 4 --json results.json
+    python bench_handlers.py --baseline results.json --max-regression 0.2
+
+With --cassette the traffic recorded by replay_gateway.py is replayed instead,
+to reproduce production latency profiles. With --baseline the run fails (exit
+code 1) when a workload's p95 latency or peak RSS grew by more than
+--max-regression compared to the baseline file.
+"""
+import argparse
+import asyncio
+from io import BytesIO
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import numpy as np
+from PIL import Image
+from replay_gateway import GatewayServer
+from stub_server import StubConfig, StubServer
+
+WORKLOADS = ("text", "image-jpeg", "image-png", "image-heic", "audio", "agent")
+
+
+def configure_environment(stub_url, warm_caches=False):
+    """Point every client at the stub and turn off what would hide handler cost; must run before importing app."""
+    os.environ["GROQ_API_KEY"] = "stub-key"
+    os.environ["TAVILY_API_KEY"] = "stub-key"
+    os.environ["GROQ_BASE_URL"] = stub_url
+    os.environ["GROQ_API_BASE"] = stub_url
+    os.environ["TAVILY_API_URL"] = stub_url
+    # El limitador frenaría el benchmark con los límites del plan gratuito
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    if not warm_caches:
+        os.environ["COMPLETION_CACHE_ENABLED"] = "false"
+        os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+        os.environ["IMAGE_CACHE_MAX_BYTES"] = "0"
+        os.environ.pop("IMAGE_CACHE_DIR", None)
+        os.environ["TAVILY_CACHE_TTL"] = "0"
+
+
+def make_image_fixture(directory, extension, size=(3024, 4032)):
+    """Photo-sized noisy gradient, so the encoder does real work."""
+    height, width = size[1], size[0]
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    noise = np.random.default_rng(0).normal(0, 25, (height, width, 3))
+    pixels = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    path = os.path.join(directory, f"fixture.{extension}")
+    Image.fromarray(pixels).save(path, **({"quality": 95} if extension == "jpg" else {}))
+    return path
+
+
+def make_audio_fixture(seconds=8, sample_rate=48000):
+    """A recorder-like webm/opus clip (or WAV without PyAV): alternating tone and silence."""
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    tone = 0.3 * np.sin(2 * np.pi * 220 * t) * (np.sin(2 * np.pi * 0.5 * t) > 0)
+    samples = (tone * 32767).astype(np.int16)
+    buffer = BytesIO()
+    try:
+        import av
+    except ImportError:
+        import wave
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(samples.tobytes())
+        return buffer.getvalue(), "audio/wav"
+    with av.open(buffer, "w", format="webm") as container:
+        stream = container.add_stream("libopus", rate=sample_rate)
+        stream.layout = "mono"
+        frame_size = 960
+        for start in range(0, len(samples), frame_size):
+            chunk = samples[start:start + frame_size]
+            frame = av.AudioFrame.from_ndarray(chunk[None, :], format="s16", layout="mono")
+            frame.sample_rate = sample_rate
+            frame.pts = start
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buffer.getvalue(), "audio/webm"
+
+
+class RSSSampler:
+    """Samples the resident set size of this process and its worker processes in a thread."""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def _rss(pid):
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    @staticmethod
+    def _children(pid):
+        children = []
+        try:
+            for tid in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{tid}/children") as f:
+                    children.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+        return children
+
+    def sample(self):
+        pid = os.getpid()
+        rss = self._rss(pid) + sum(self._rss(child) for child in self._children(pid))
+        if not rss:
+            # Sin /proc: máximo histórico del proceso (KB en Linux)
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        self.peak = max(self.peak, rss)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class HandlerBench:
+    def __init__(self, app, fixtures):
+        self.app = app
+        self.fixtures = fixtures
+
+    def new_session(self):
+        """Fresh Chainlit context with an emitter that records what would be sent to the browser."""
+        from chainlit.context import ChainlitContext, context_var
+        from chainlit.emitter import BaseChainlitEmitter
+        from chainlit.session import HTTPSession
+
+        sent = []
+
+        class RecordingEmitter(BaseChainlitEmitter):
+            async def send_step(self, step_dict):
+                sent.append(step_dict)
+
+            async def update_step(self, step_dict):
+                sent.append(step_dict)
+
+        session = HTTPSession(id=str(uuid.uuid4()), thread_id=str(uuid.uuid4()), client_type="webapp")
+        context_var.set(ChainlitContext(session, emitter=RecordingEmitter(session)))
+        return sent
+
+    @staticmethod
+    def failed(sent):
+        messages = [step for step in sent if step.get("type") == "assistant_message"]
+        return not messages or any("error" in (step.get("output") or "").lower() for step in messages)
+
+    async def run_text(self):
+        import chainlit as cl
+        await self.app.main(cl.Message(content="What makes Groq LPUs fast for inference?"))
+
+    async def run_image(self, path, mime):
+        import chainlit as cl
+        element = cl.Image(name=os.path.basename(path), path=path, mime=mime)
+        await self.app.main(cl.Message(content="Describe this image.", elements=[element]))
+
+    async def run_audio(self):
+        import chainlit as cl
+        data, _ = self.fixtures["audio"]
+        cl.user_session.set("audio_buffer", BytesIO(data))
+        cl.user_session.set("transcriber", None)
+        await self.app.on_audio_end()
+
+    async def run_agent(self):
+        import chainlit as cl
+        self.app.set_setting("use_tavily_agent", True)
+        await self.app.main(cl.Message(content="What is the latest news about Groq?"))
+
+    def handler_for(self, workload):
+        if workload == "text":
+            return self.run_text
+        if workload == "audio":
+            return self.run_audio
+        if workload == "agent":
+            return self.run_agent
+        path, mime = self.fixtures[workload]
+        return lambda: self.run_image(path, mime)
+
+    async def run_workload(self, workload, iterations, concurrency):
+        handler = self.handler_for(workload)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+        errors = 0
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                sent = self.new_session()
+                start_time = time.perf_counter()
+                try:
+                    await handler()
+                except Exception as e:
+                    print(f"{workload}: handler raised {e!r}", file=sys.stderr)
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - start_time)
+                if self.failed(sent):
+                    errors += 1
+                    outputs = [step.get("output") for step in sent if step.get("type") == "assistant_message"]
+                    print(f"{workload}: failed, messages sent: {outputs}", file=sys.stderr)
+
+        with RSSSampler() as rss:
+            start_time = time.perf_counter()
+            await asyncio.gather(*[one() for _ in range(iterations)])
+            wall_time = time.perf_counter() - start_time
+        return {
+            "workload": workload,
+            "iterations": iterations,
+            "concurrency": concurrency,
+            "errors": errors,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "mean": statistics.fmean(latencies) if latencies else None,
+            "throughput": iterations / wall_time,
+            "peak_rss_mb": rss.peak / (1024 * 1024),
+        }
+
+
+def format_report(results):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.0f}"
+
+    lines = [
+        f"{'workload':<12} {'n':>4} {'conc':>4} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'req/s':>7} {'peak RSS MB':>12}"
+    ]
+    for r in results:
+        lines.append(
+            f"{r['workload']:<12} {r['iterations']:>4} {r['concurrency']:>4} {r['errors']:>4} "
+            f"{ms(r['p50']):>8} {ms(r['p95']):>8} {ms(r['p99']):>8} {r['throughput']:>7.2f} {r['peak_rss_mb']:>12.1f}"
+        )
+    return "\n".join(lines)
+
+
+def find_regressions(results, baseline, max_regression):
+    regressions = []
+    previous = {r["workload"]: r for r in baseline["results"]}
+    for r in results:
+        before = previous.get(r["workload"])
+        if before is None:
+            continue
+        for metric in ("p95", "peak_rss_mb"):
+            if r[metric] is not None and before[metric] and r[metric] > before[metric] * (1 + max_regression):
+                regressions.append(f"{r['workload']} {metric}: {before[metric]:.3f} -> {r[metric]:.3f}")
+        if r["errors"] > before["errors"]:
+            regressions.append(f"{r['workload']} errors: {before['errors']} -> {r['errors']}")
+    return regressions
+
+
+async def run(args):
+    from images import get_image_executor
+    import app
+
+    fixtures_dir = tempfile.mkdtemp(prefix="tkm-bench-")
+    fixtures = {
+        "image-jpeg": (make_image_fixture(fixtures_dir, "jpg"), "image/jpeg"),
+        "image-png": (make_image_fixture(fixtures_dir, "png"), "image/png"),
+        "audio": make_audio_fixture(),
+    }
+    if args.heic:
+        fixtures["image-heic"] = (args.heic, "image/heic")
+
+    if not args.verbose:
+        # Los logs JSON de la app van a stdout, igual que el informe; LOG_LEVEL llega a los procesos de imágenes
+        os.environ["LOG_LEVEL"] = "WARNING"
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        logging.getLogger("tkm").setLevel(logging.WARNING)
+    # Arrancar el pool de procesos antes de medir
+    get_image_executor()
+    bench = HandlerBench(app, fixtures)
+    results = []
+    for workload in args.workloads:
+        if workload == "image-heic" and workload not in fixtures:
+            print("Skipping image-heic: pass --heic PATH (no HEIC encoder available to generate one)", file=sys.stderr)
+            continue
+        print(f"Running {workload}...", file=sys.stderr)
+        if args.warmup:
+            await bench.run_workload(workload, args.warmup, args.concurrency)
+        results.append(await bench.run_workload(workload, args.iterations, args.concurrency))
+    return results
+
+
+def main():
+    defaults = StubConfig()
+    parser = argparse.ArgumentParser(description="Benchmark the Chainlit handlers against a stub Groq/Tavily server")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help=f"comma-separated subset of {', '.join(WORKLOADS)}")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=2, help="untimed iterations per workload")
+    parser.add_argument("--heic", help="HEIC fixture to use for the image-heic workload")
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="stub seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens)
+    parser.add_argument("--transcription-latency", type=float, default=defaults.transcription_latency)
+    parser.add_argument("--search-latency", type=float, default=defaults.search_latency)
+    parser.add_argument("--cassette", help="replay recorded traffic (replay_gateway.py) instead of the stub")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="time compression of the replayed traffic")
+    parser.add_argument("--warm-caches", action="store_true", help="keep the completion, image and search caches on")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed growth over the baseline (0.2 = 20%%)")
+    parser.add_argument("--verbose", action="store_true", help="show the app's info logs")
+    args = parser.parse_args()
+    args.workloads = [workload.strip() for workload in args.workloads.split(",") if workload.strip()]
+    unknown = set(args.workloads) - set(WORKLOADS)
+    if unknown:
+        parser.error(f"unknown workloads: {', '.join(sorted(unknown))}")
+
+    config = StubConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        transcription_latency=args.transcription_latency,
+        search_latency=args.search_latency,
+    )
+    if args.cassette:
+        server = GatewayServer("replay", args.cassette, speed=args.replay_speed)
+    else:
+        server = StubServer(config)
+    with server:
+        configure_environment(server.url, args.warm_caches)
+        results = asyncio.run(run(args))
+        print(f"Backend requests served: {server.app.state.stats}", file=sys.stderr)
+
+    print(format_report(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            backend = {"cassette": args.cassette, "replay_speed": args.replay_speed} if args.cassette else vars(config)
+            json.dump({"config": backend, "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.max_regression)
+        if regressions:
+            print("Regressions against the baseline:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
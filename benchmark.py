@@ -0,0 +1,69 @@
+import asyncio
+import time
+from streaming import consume_stream
+
+
+async def benchmark_model(client, model_id, messages):
+    """Stream one completion from model_id and collect client-side and Groq-side timings.
+
+    The request goes straight to the model (no cache, retries or failover) so the
+    numbers describe that model alone.
+    """
+    start_time = time.perf_counter()
+    try:
+        stream = await client.chat.completions.create(model=model_id, messages=messages, stream=True)
+        stats, _ = await consume_stream(stream, start_time)
+    except Exception as e:
+        return {"model": model_id, "error": str(e)}
+    return {"model": model_id, "error": None, **stats}
+
+
+async def run_benchmark(client, model_ids, prompt):
+    """Send the same prompt to every model concurrently; results keep the order of model_ids."""
+    messages = [{"role": "user", "content": prompt}]
+    return list(await asyncio.gather(*[benchmark_model(client, model_id, messages) for model_id in model_ids]))
+
+
+def _format_seconds(value):
+    return "-" if value is None else f"{value * 1000:.0f} ms"
+
+
+def render_benchmark_table(results):
+    rows = [
+        "| Model | Time to first token | Total latency | Output tokens/s | Queue time |",
+        "|---|---|---|---|---|",
+    ]
+    for result in sorted(results, key=lambda r: (r["error"] is not None, r.get("total_latency") or 0)):
+        if result["error"]:
+            error = " ".join(result["error"].split()).replace("|", "/")
+            rows.append(f"| {result['model']} | error: {error} | | | |")
+            continue
+        tokens_per_second = result["tokens_per_second"]
+        rows.append(
+            f"| {result['model']} | {_format_seconds(result['ttft'])} | {_format_seconds(result['total_latency'])} "
+            f"| {'-' if tokens_per_second is None else f'{tokens_per_second:.0f}'} "
+            f"| {_format_seconds(result['queue_time'])} |"
+        )
+    return "\n".join(rows)
+
+
+def render_session_summary(runs):
+    """Average of every successful result per model across the session's benchmark runs."""
+    totals = {}
+    for run in runs:
+        for result in run["results"]:
+            if not result["error"]:
+                totals.setdefault(result["model"], []).append(result)
+    rows = [
+        "| Model | Runs | Avg time to first token | Avg total latency | Avg output tokens/s |",
+        "|---|---|---|---|---|",
+    ]
+    for model_id, results in sorted(totals.items(), key=lambda item: sum(r["total_latency"] for r in item[1]) / len(item[1])):
+        speeds = [r["tokens_per_second"] for r in results if r["tokens_per_second"] is not None]
+        rows.append(
+            f"| {model_id} | {len(results)} "
+            f"| {_format_seconds(sum(r['ttft'] for r in results) / len(results))} "
+            f"| {_format_seconds(sum(r['total_latency'] for r in results) / len(results))} "
+            f"| {f'{sum(speeds) / len(speeds):.0f}' if speeds else '-'} |"
+        )
+    return "\n".join(rows)
@@ -0,0 +1,257 @@
+from collections import OrderedDict
+import hashlib
+from itertools import pairwise
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+import numpy as np
+
+# Caché de respuestas (opcional): memoria LRU + SQLite persistente
+COMPLETION_CACHE_ENABLED = os.getenv("COMPLETION_CACHE_ENABLED", "false").lower() == "true"
+COMPLETION_CACHE_TTL = float(os.getenv("COMPLETION_CACHE_TTL", "3600"))
+COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", "1024"))
+COMPLETION_CACHE_DB = os.getenv("COMPLETION_CACHE_DB", ".cache/completions.sqlite3")
+
+# Caché semántica (opcional) para preguntas parafraseadas
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "512"))
+SEMANTIC_CACHE_DIM = 1024
+# Calibrado junto con la comprobación de palabras de contenido: esta deja fuera las preguntas que
+# solo cambian una palabra ("sum"/"product", "Mexico"/"Spain"), que superan 0.9 de similitud
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))
+# Umbrales por modelo, p. ej. "llama3-8b-8192=0.95,gemma-7b-it=0.93"
+SEMANTIC_CACHE_THRESHOLDS = {
+    model_id: float(threshold)
+    for model_id, threshold in (
+        item.split("=") for item in os.getenv("SEMANTIC_CACHE_THRESHOLDS", "").split(",") if "=" in item
+    )
+}
+
+
+# Palabras que no cambian la pregunta; las negaciones y los números sí cuentan como contenido
+SEMANTIC_STOPWORDS = frozenset({
+    "a", "an", "the", "this", "that", "these", "those", "is", "are", "was", "were", "be", "been",
+    "being", "am", "do", "does", "did", "done", "can", "could", "will", "would",
+    "shall", "should", "may", "might", "must", "have", "has", "had", "having", "i", "me", "my",
+    "we", "our", "you", "your", "he", "she", "it", "its", "they", "them", "their",
+    "what", "whats", "what's", "which", "who", "whom", "whose", "how", "when", "where", "why", "of",
+    "in", "on", "at", "to", "for", "from", "by", "with", "about", "into",
+    "as", "and", "or", "but", "if", "then", "so", "than", "please", "tell", "show", "explain",
+    "give", "let", "us", "s", "t", "there", "here", "any", "some",
+})
+
+
+def normalize_text(text):
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+def is_text_only(messages):
+    return all(isinstance(message["content"], str) for message in messages)
+
+
+def completion_cache_key(model_id, messages, temperature=None):
+    """Hash of (model, normalized messages, temperature) for text-only conversations."""
+    normalized = [
+        {"role": message["role"], "content": normalize_text(message["content"])}
+        for message in messages
+    ]
+    payload = json.dumps([model_id, normalized, temperature], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """Exact-match cache of completions with an LRU memory tier and a SQLite tier.
+
+    Entries expire ttl seconds after they were stored. Reads from SQLite are promoted
+    to memory. Pass db_path=None to keep the cache in memory only.
+    """
+
+    def __init__(self, ttl=COMPLETION_CACHE_TTL, max_entries=COMPLETION_CACHE_MAX_ENTRIES,
+                 db_path=COMPLETION_CACHE_DB):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS completions "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    def _store_in_memory(self, key, response, expires_at):
+        self._entries[key] = (expires_at, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, response = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self._entries[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, expires_at FROM completions WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row is not None:
+                    self._store_in_memory(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        if not response:
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store_in_memory(key, response, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO completions (key, response, expires_at) VALUES (?, ?, ?)",
+                    (key, response, expires_at),
+                )
+                self._db.execute("DELETE FROM completions WHERE expires_at <= ?", (time.time(),))
+                self._db.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+_completion_cache = None
+
+
+def get_completion_cache():
+    """Shared CompletionCache, created on first use so nothing is written while it is off."""
+    global _completion_cache
+    if _completion_cache is None:
+        _completion_cache = CompletionCache()
+    return _completion_cache
+
+
+def content_tokens(text):
+    """Words that carry the question's meaning, in order: no stopwords, simple plurals folded.
+
+    The order is kept because it changes the question ("usd to eur" is not "eur to usd").
+    """
+    tokens = []
+    for word in re.findall(r"\w+", normalize_text(text)):
+        if word in SEMANTIC_STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tuple(tokens)
+
+
+def embed_text(text, dim=SEMANTIC_CACHE_DIM):
+    """Local hashed n-gram embedding: words, word bigrams and character trigrams, L2-normalized.
+
+    Runs on CPU in microseconds with no model download or network call. Similar
+    wordings share most of their trigrams, so their cosine similarity stays high;
+    the bigrams keep the word order, so swapped words lower it.
+    """
+    words = re.findall(r"\w+", normalize_text(text))
+    features = list(words)
+    features.extend(f"{first} {second}" for first, second in pairwise(words))
+    for word in words:
+        padded = f" {word} "
+        features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        hashed = zlib.crc32(feature.encode("utf-8"))
+        vector[hashed % dim] += 1.0 if hashed & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def semantic_threshold(model_id):
+    return SEMANTIC_CACHE_THRESHOLDS.get(model_id, SEMANTIC_CACHE_THRESHOLD)
+
+
+class SemanticCache:
+    """In-memory vector index of answered questions, one ring buffer per (model, temperature).
+
+    lookup() returns the stored answer of the most similar earlier question when its
+    cosine similarity reaches the model's threshold and both questions have the same
+    content words in the same order, since the n-gram embedding scores questions that
+    differ in a single word (a number, a place) as near duplicates. Entries expire after
+    ttl seconds and the oldest one is overwritten once max_entries is reached.
+    """
+
+    def __init__(self, max_entries=SEMANTIC_CACHE_MAX_ENTRIES, ttl=COMPLETION_CACHE_TTL, dim=SEMANTIC_CACHE_DIM):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.dim = dim
+        self.hits = 0
+        self.misses = 0
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def _get_index(self, key):
+        index = self._indexes.get(key)
+        if index is None:
+            index = {
+                "vectors": np.zeros((self.max_entries, self.dim), dtype=np.float32),
+                "expires_at": np.zeros(self.max_entries),
+                "answers": [None] * self.max_entries,
+                "tokens": [None] * self.max_entries,
+                "next": 0,
+            }
+            self._indexes[key] = index
+        return index
+
+    def lookup(self, model_id, question, temperature=None):
+        """Return (answer, similarity) for a close enough earlier question, or None."""
+        vector = embed_text(question, self.dim)
+        tokens = content_tokens(question)
+        with self._lock:
+            index = self._indexes.get((model_id, temperature))
+            if index is not None:
+                similarities = index["vectors"] @ vector
+                similarities[index["expires_at"] <= time.time()] = -1.0
+                candidates = np.flatnonzero(similarities >= semantic_threshold(model_id))
+                for slot in candidates[np.argsort(similarities[candidates])[::-1]]:
+                    if index["tokens"][slot] == tokens:
+                        self.hits += 1
+                        return index["answers"][slot], float(similarities[slot])
+            self.misses += 1
+            return None
+
+    def add(self, model_id, question, answer, temperature=None):
+        if not answer:
+            return
+        vector = embed_text(question, self.dim)
+        with self._lock:
+            index = self._get_index((model_id, temperature))
+            slot = index["next"]
+            index["vectors"][slot] = vector
+            index["expires_at"][slot] = time.time() + self.ttl
+            index["answers"][slot] = answer
+            index["tokens"][slot] = content_tokens(question)
+            index["next"] = (slot + 1) % self.max_entries
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,248 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import contextlib
+from io import BytesIO
+import asyncio
+import base64
+import hashlib
+import os
+import tempfile
+import threading
+from PIL import Image, ImageOps
+import pyheif
+from log import get_logger
+from metrics import IMAGE_QUEUE_DEPTH
+
+logger = get_logger("images")
+
+# Lado mayor (px) que cada modelo de visión usa realmente; lo demás solo añade bytes
+VISION_MODEL_MAX_EDGE = {
+    "llama-3.2-11b-vision-preview": 1120,  # 2x2 teselas de 560 px
+    "llava-v1.5-7b-4096-preview": 336,
+}
+DEFAULT_MAX_EDGE = 1120
+IMAGE_BYTE_BUDGET = int(os.getenv("IMAGE_BYTE_BUDGET", str(400 * 1024)))
+JPEG_QUALITIES = (90, 85, 80, 70, 60, 50)
+
+# Pool de procesos para decodificar/codificar imágenes fuera del event loop
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_JOB_TIMEOUT = float(os.getenv("IMAGE_JOB_TIMEOUT", "30"))
+
+_image_executor = None
+_image_queue_depth = 0
+
+# Caché de imágenes ya convertidas, indexada por el hash del contenido
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR")  # Opcional: activa la caché en disco
+IMAGE_CACHE_MAX_DISK_BYTES = int(os.getenv("IMAGE_CACHE_MAX_DISK_BYTES", str(512 * 1024 * 1024)))
+
+
+def max_image_edge(model_id):
+    return VISION_MODEL_MAX_EDGE.get(model_id, DEFAULT_MAX_EDGE)
+
+
+def to_jpeg_base64(image, max_edge=DEFAULT_MAX_EDGE, byte_budget=IMAGE_BYTE_BUDGET):
+    """Downscale to max_edge, strip metadata and encode as base64 JPEG within byte_budget.
+
+    The highest quality in JPEG_QUALITIES that fits the budget is used; if none fits,
+    the lowest one is kept.
+    """
+    image = ImageOps.exif_transpose(image)  # Aplicar la orientación antes de descartar el EXIF
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    for quality in JPEG_QUALITIES:
+        jpeg_bytes = BytesIO()
+        # Sin exif/icc_profile: Pillow no copia los metadatos al guardar
+        image.save(jpeg_bytes, format="JPEG", quality=quality, optimize=True)
+        if jpeg_bytes.tell() <= byte_budget:
+            break
+    logger.debug("jpeg_encoded", width=image.size[0], height=image.size[1], quality=quality, bytes=jpeg_bytes.tell())
+    return base64.b64encode(jpeg_bytes.getvalue()).decode('utf-8')
+
+
+def encode_image(image_path, max_edge=DEFAULT_MAX_EDGE):
+    try:
+        with Image.open(image_path) as image:
+            base64_image = to_jpeg_base64(image, max_edge)
+            return base64_image
+    except Exception as e:
+        logger.error("image_encoding_failed", path=image_path, error=str(e))
+        return None
+
+
+def convert_heic_to_jpeg(heic_file_path, max_edge=DEFAULT_MAX_EDGE):
+    try:
+        logger.debug("heic_conversion_started", path=heic_file_path)
+        heif_file = pyheif.read(heic_file_path)
+        image = Image.frombytes(
+            mode=heif_file.mode,
+            size=heif_file.size,
+            data=heif_file.data,
+            decoder_name="raw"
+        )
+        base64_image = to_jpeg_base64(image, max_edge)
+        return base64_image
+    except Exception as e:
+        logger.error("heic_conversion_failed", path=heic_file_path, error=str(e))
+        return None
+
+
+def convert_png_to_jpeg(png_file_path, max_edge=DEFAULT_MAX_EDGE):
+    try:
+        logger.debug("png_conversion_started", path=png_file_path)
+        with Image.open(png_file_path) as image:
+            base64_image = to_jpeg_base64(image, max_edge)
+        return base64_image
+    except Exception as e:
+        logger.error("png_conversion_failed", path=png_file_path, error=str(e))
+        return None
+
+
+def get_image_executor():
+    global _image_executor
+    if _image_executor is None:
+        _image_executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _image_executor
+
+
+async def run_image_job(func, *args, timeout=IMAGE_JOB_TIMEOUT):
+    """Run an image conversion function on the process pool and await its result.
+
+    Returns None, like the conversion functions do on failure, if the job does not
+    finish within timeout seconds. A job that is already running keeps its worker
+    until it completes; one still waiting in the queue is cancelled. If a worker
+    dies (e.g. killed for running out of memory on a huge HEIC) the broken pool is
+    replaced, so later uploads get fresh workers.
+    """
+    global _image_executor, _image_queue_depth
+    loop = asyncio.get_running_loop()
+    _image_queue_depth += 1
+    IMAGE_QUEUE_DEPTH.set(_image_queue_depth)
+    logger.info("image_job_queued", job=func.__name__, queue_depth=_image_queue_depth)
+    executor = get_image_executor()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(executor, func, *args), timeout)
+    except asyncio.TimeoutError:
+        logger.warning("image_job_timed_out", job=func.__name__, timeout=timeout)
+        return None
+    except BrokenProcessPool as e:
+        logger.error("image_pool_broken", job=func.__name__, error=str(e))
+        # Otro trabajo pudo haber sustituido ya el pool roto
+        if _image_executor is executor:
+            _image_executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+        return None
+    finally:
+        _image_queue_depth -= 1
+        IMAGE_QUEUE_DEPTH.set(_image_queue_depth)
+
+
+def image_cache_key(image_path, max_edge=DEFAULT_MAX_EDGE, byte_budget=IMAGE_BYTE_BUDGET):
+    """Content hash of the uploaded file plus the settings that shape the encoded output."""
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as image_file:
+        for block in iter(lambda: image_file.read(1024 * 1024), b""):
+            digest.update(block)
+    return f"{digest.hexdigest()}-{max_edge}-{byte_budget}"
+
+
+class ImageCache:
+    """Size-bounded LRU of base64 JPEGs keyed by image_cache_key(), with an optional disk tier.
+
+    Disk entries survive restarts and are promoted to memory when read; the oldest
+    files are removed once the directory grows past max_disk_bytes. Files are written
+    to a temporary name and renamed, so a reader never sees a partial entry, and a
+    failed disk write only costs the cache entry, never the upload.
+    """
+
+    def __init__(self, max_bytes=IMAGE_CACHE_MAX_BYTES, cache_dir=IMAGE_CACHE_DIR,
+                 max_disk_bytes=IMAGE_CACHE_MAX_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.b64")
+
+    def _store_in_memory(self, key, base64_image):
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = base64_image
+            self._size += len(base64_image)
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get(self, key):
+        with self._lock:
+            base64_image = self._entries.get(key)
+            if base64_image is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return base64_image
+        if self.cache_dir:
+            try:
+                with open(self._disk_path(key), "r") as cache_file:
+                    base64_image = cache_file.read()
+                os.utime(self._disk_path(key))
+                self._store_in_memory(key, base64_image)
+                self.hits += 1
+                return base64_image
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("image_cache_read_failed", key=key, error=str(e))
+        self.misses += 1
+        return None
+
+    def put(self, key, base64_image):
+        self._store_in_memory(key, base64_image)
+        if self.cache_dir:
+            try:
+                self._write_to_disk(key, base64_image)
+                self._trim_disk()
+            except OSError as e:
+                logger.warning("image_cache_write_failed", key=key, error=str(e))
+
+    def _write_to_disk(self, key, base64_image):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as cache_file:
+                cache_file.write(base64_image)
+            os.replace(tmp_path, self._disk_path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _trim_disk(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".b64"):
+                continue  # Escrituras en curso de otros hilos
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # Borrado por otro trim concurrente
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
+
+
+image_cache = ImageCache()
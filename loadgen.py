@@ -0,0 +1,465 @@
+"""Multi-session load generator for the Chainlit app, speaking the Socket.IO protocol.
+
+Opens N simulated browser sessions against `chainlit run app.py`. Each session
+sends settings updates, text messages, image uploads and recorded audio streams
+in a configurable mix and rate. The run reports latency percentiles, error
+rates and event-loop lag.
+
+    python loadgen.py --sessions 20 --duration 60 --rate 0.2 --mix text=6,image=2,audio=1,settings=1
+
+Without --url the tool starts the stub Groq/Tavily server (or, with --cassette,
+the replay gateway) and a headless Chainlit server wired to it, so the test runs
+without network. The asyncio Socket.IO client needs aiohttp
+(`pip install aiohttp`).
+"""
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import httpx
+import socketio
+from bench_handlers import configure_environment, make_audio_fixture, make_image_fixture, percentile
+
+ACTIONS = ("text", "image", "audio", "settings")
+TEXT_PROMPTS = (
+    "What makes Groq LPUs fast for inference?",
+    "Summarize the benefits of streaming responses.",
+    "Explain the difference between latency and throughput.",
+)
+AUDIO_CHUNK_BYTES = 16 * 1024  # Aproximadamente un segundo de webm/opus, como MediaRecorder
+LAG_PROBE_PATH = "/auth/config"  # Respuesta JSON pequeña servida por el mismo event loop
+
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def parse_mix(value):
+    """Parse "text=6,image=2" into weights for ACTIONS."""
+    weights = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"unknown action {name!r}, expected one of {', '.join(ACTIONS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Recorder:
+    """Latencies, first-response times and errors per action."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.first_response = {}
+        self.errors = {}
+        self.counts = {}
+
+    def record(self, action, latency=None, first_response=None, error=None):
+        self.counts[action] = self.counts.get(action, 0) + 1
+        if error is not None:
+            self.errors.setdefault(action, []).append(error)
+            return
+        self.latencies.setdefault(action, []).append(latency)
+        if first_response is not None:
+            self.first_response.setdefault(action, []).append(first_response)
+
+    def summary(self):
+        rows = []
+        for action in sorted(self.counts):
+            latencies = self.latencies.get(action, [])
+            first_response = self.first_response.get(action, [])
+            errors = self.errors.get(action, [])
+            rows.append({
+                "action": action,
+                "count": self.counts[action],
+                "errors": len(errors),
+                "error_rate": len(errors) / self.counts[action],
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "first_response_p50": percentile(first_response, 50),
+                "first_response_p95": percentile(first_response, 95),
+                "sample_errors": sorted(set(errors))[:3],
+            })
+        return rows
+
+
+class SimulatedSession:
+    """One browser tab: a Socket.IO connection plus the HTTP calls the UI makes."""
+
+    def __init__(self, url, http_client, fixtures, timeout):
+        self.url = url
+        self.http = http_client
+        self.fixtures = fixtures
+        self.timeout = timeout
+        self.session_id = str(uuid.uuid4())
+        self.thread_id = str(uuid.uuid4())
+        self.settings = {}
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self._task_done = asyncio.Event()
+        self._ready = asyncio.Event()
+        self._first_response_at = None
+        self._pending_asks = 0
+        self._errors = []
+        self.sio.on("task_end", self._on_task_end)
+        self.sio.on("new_message", self._on_message)
+        self.sio.on("stream_start", self._on_first_response)
+        self.sio.on("stream_token", self._on_first_response)
+        self.sio.on("chat_settings", self._on_chat_settings)
+        self.sio.on("ask", self._on_ask)
+
+    async def _on_task_end(self, _data):
+        # send_ask_user cierra la tarea temporalmente tras cada respuesta a "ask"
+        if self._pending_asks:
+            self._pending_asks -= 1
+            return
+        self._task_done.set()
+
+    async def _on_first_response(self, _data):
+        if self._first_response_at is None:
+            self._first_response_at = time.perf_counter()
+
+    async def _on_message(self, data):
+        if data.get("type") == "assistant_message":
+            self._ready.set()
+            await self._on_first_response(data)
+            output = data.get("output") or ""
+            if data.get("name") == "Error" or output.startswith("Error"):
+                self._errors.append(output[:200])
+
+    async def _on_chat_settings(self, widgets):
+        self.settings = {widget["id"]: widget.get("initial") for widget in widgets}
+
+    async def _on_ask(self, _data):
+        """Answer AskUserMessage prompts (the vision follow-up) straight away."""
+        self._pending_asks += 1
+        return {
+            "id": str(uuid.uuid4()),
+            "threadId": self.thread_id,
+            "createdAt": utc_now(),
+            "name": "User",
+            "type": "user_message",
+            "output": "switch to text",
+        }
+
+    async def connect(self):
+        await self.sio.connect(
+            self.url,
+            socketio_path="/ws/socket.io",
+            transports=["websocket"],
+            headers={
+                "X-Chainlit-Session-Id": self.session_id,
+                "X-Chainlit-Thread-Id": self.thread_id,
+                "X-Chainlit-Client-Type": "webapp",
+                "user-env": "{}",
+            },
+        )
+        await self.sio.emit("connection_successful")
+        # on_chat_start termina con el mensaje de bienvenida
+        await asyncio.wait_for(self._ready.wait(), self.timeout)
+
+    async def disconnect(self):
+        await self.sio.disconnect()
+
+    async def _run_task(self, send):
+        """Send an event and wait for the server's task_end; returns (latency, first_response)."""
+        self._task_done.clear()
+        self._first_response_at = None
+        self._errors = []
+        start_time = time.perf_counter()
+        await send()
+        await asyncio.wait_for(self._task_done.wait(), self.timeout)
+        if self._errors:
+            raise RuntimeError(self._errors[0])
+        end_time = time.perf_counter()
+        first_response = self._first_response_at - start_time if self._first_response_at else None
+        return end_time - start_time, first_response
+
+    def _message(self, content):
+        return {
+            "id": str(uuid.uuid4()),
+            "threadId": self.thread_id,
+            "createdAt": utc_now(),
+            "name": "User",
+            "type": "user_message",
+            "output": content,
+        }
+
+    async def send_text(self):
+        payload = {"message": self._message(random.choice(TEXT_PROMPTS)), "fileReferences": None}
+        return await self._run_task(lambda: self.sio.emit("client_message", payload))
+
+    async def upload(self, name, data, mime):
+        response = await self.http.post(
+            f"{self.url}/project/file",
+            params={"session_id": self.session_id},
+            files={"file": (name, data, mime)},
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+
+    async def send_image(self):
+        name, data, mime = random.choice(self.fixtures["images"])
+
+        async def send():
+            file_id = await self.upload(name, data, mime)
+            payload = {"message": self._message("Describe this image."), "fileReferences": [{"id": file_id}]}
+            await self.sio.emit("client_message", payload)
+
+        return await self._run_task(send)
+
+    async def send_audio(self, chunk_interval):
+        data, mime = self.fixtures["audio"]
+        chunks = [data[i:i + AUDIO_CHUNK_BYTES] for i in range(0, len(data), AUDIO_CHUNK_BYTES)]
+        for i, chunk in enumerate(chunks):
+            await self.sio.emit("audio_chunk", {
+                "isStart": i == 0,
+                "mimeType": mime,
+                "elapsedTime": i * 1000,
+                "data": chunk,
+            })
+            await asyncio.sleep(chunk_interval)
+        # La latencia se mide desde el final de la grabación, como la percibe el usuario
+        return await self._run_task(lambda: self.sio.emit("audio_end", {"fileReferences": None}))
+
+    async def send_settings(self):
+        start_time = time.perf_counter()
+        await self.sio.call("chat_settings_change", dict(self.settings), timeout=self.timeout)
+        return time.perf_counter() - start_time, None
+
+
+async def measure_loop_lag(samples, stop, interval=0.1):
+    """Lag of this process's own event loop; if it is high, the generator itself is the bottleneck."""
+    while not stop.is_set():
+        start_time = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start_time - interval)
+
+
+async def probe_server_lag(http_client, url, samples, stop, interval=0.25):
+    """Latency of a trivial HTTP request, which waits behind whatever is blocking the server's loop."""
+    while not stop.is_set():
+        start_time = time.perf_counter()
+        try:
+            await http_client.get(f"{url}{LAG_PROBE_PATH}")
+            samples.append(time.perf_counter() - start_time)
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(interval)
+
+
+async def run_session(url, http_client, fixtures, args, recorder, weights, deadline):
+    session = SimulatedSession(url, http_client, fixtures, args.timeout)
+    start_time = time.perf_counter()
+    try:
+        await session.connect()
+    except Exception as e:
+        recorder.record("connect", error=f"{type(e).__name__}: {e}")
+        return
+    recorder.record("connect", time.perf_counter() - start_time)
+
+    actions = list(weights)
+    try:
+        while time.perf_counter() < deadline:
+            # Llegadas de Poisson: tiempo entre acciones exponencial con media 1/rate
+            await asyncio.sleep(min(random.expovariate(args.rate), max(0.0, deadline - time.perf_counter())))
+            if time.perf_counter() >= deadline:
+                break
+            action = random.choices(actions, weights=[weights[a] for a in actions])[0]
+            try:
+                if action == "text":
+                    latency, first_response = await session.send_text()
+                elif action == "image":
+                    latency, first_response = await session.send_image()
+                elif action == "audio":
+                    latency, first_response = await session.send_audio(args.audio_chunk_interval)
+                else:
+                    latency, first_response = await session.send_settings()
+            except Exception as e:
+                recorder.record(action, error=f"{type(e).__name__}: {e}")
+                continue
+            recorder.record(action, latency, first_response)
+    finally:
+        await session.disconnect()
+
+
+def wait_for_http(url, timeout, process=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{process.args[0]} exited with code {process.returncode}")
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise TimeoutError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def start_backend(args, log_file):
+    """Start the stub (or replay gateway) and a headless Chainlit server; returns (url, processes)."""
+    backend_port = free_port()
+    if args.cassette:
+        command = [sys.executable, "replay_gateway.py", "replay", "--cassette", args.cassette,
+                   "--speed", str(args.replay_speed), "--port", str(backend_port)]
+        probe = "/gateway/stats"
+    else:
+        command = [sys.executable, "stub_server.py", "--port", str(backend_port),
+                   "--latency", str(args.latency), "--tokens-per-second", str(args.tokens_per_second)]
+        probe = "/stats"
+    backend = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT)
+    backend_url = f"http://127.0.0.1:{backend_port}"
+    wait_for_http(backend_url + probe, 30, backend)
+
+    configure_environment(backend_url)
+    app_port = free_port()
+    server = subprocess.Popen(
+        ["chainlit", "run", "app.py", "--headless", "--host", "127.0.0.1", "--port", str(app_port)],
+        stdout=log_file, stderr=subprocess.STDOUT, env=os.environ.copy(),
+    )
+    url = f"http://127.0.0.1:{app_port}"
+    wait_for_http(url + LAG_PROBE_PATH, 90, server)
+    return url, [server, backend]
+
+
+def format_report(rows, server_lag, generator_lag, idle_probe, wall_time, sessions):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.0f}"
+
+    lines = [
+        f"{sessions} sessions over {wall_time:.1f}s",
+        f"{'action':<10} {'count':>6} {'errors':>7} {'err %':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+        f"{'first p50':>10} {'first p95':>10}",
+    ]
+    for r in rows:
+        lines.append(
+            f"{r['action']:<10} {r['count']:>6} {r['errors']:>7} {r['error_rate'] * 100:>6.1f} {ms(r['p50']):>8} "
+            f"{ms(r['p95']):>8} {ms(r['p99']):>8} {ms(r['first_response_p50']):>10} {ms(r['first_response_p95']):>10}"
+        )
+        for error in r["sample_errors"]:
+            lines.append(f"    {error}")
+    lag = [max(0.0, sample - idle_probe) for sample in server_lag]
+    lines.append(
+        f"Server event-loop lag (probe latency over the idle {ms(idle_probe)} ms): p50 {ms(percentile(lag, 50))} ms, "
+        f"p95 {ms(percentile(lag, 95))} ms, p99 {ms(percentile(lag, 99))} ms, max {ms(max(lag, default=None))} ms"
+    )
+    lines.append(
+        f"Load generator event-loop lag: p95 {ms(percentile(generator_lag, 95))} ms, "
+        f"max {ms(max(generator_lag, default=None))} ms"
+    )
+    return "\n".join(lines)
+
+
+async def run(args, url, fixtures):
+    recorder = Recorder()
+    server_lag, generator_lag = [], []
+    stop = asyncio.Event()
+    limits = httpx.Limits(max_connections=args.sessions + 10)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as http_client:
+        idle = []
+        for _ in range(10):
+            start_time = time.perf_counter()
+            await http_client.get(f"{url}{LAG_PROBE_PATH}")
+            idle.append(time.perf_counter() - start_time)
+        idle_probe = statistics.median(idle)
+
+        monitors = [
+            asyncio.create_task(measure_loop_lag(generator_lag, stop)),
+            asyncio.create_task(probe_server_lag(http_client, url, server_lag, stop)),
+        ]
+        start_time = time.perf_counter()
+        deadline = start_time + args.duration
+        sessions = []
+        for _ in range(args.sessions):
+            sessions.append(asyncio.create_task(
+                run_session(url, http_client, fixtures, args, recorder, args.mix, deadline)
+            ))
+            # Arranque escalonado para no conectar todas las sesiones a la vez
+            await asyncio.sleep(args.ramp_up / args.sessions)
+        await asyncio.gather(*sessions)
+        wall_time = time.perf_counter() - start_time
+        stop.set()
+        await asyncio.gather(*monitors)
+    return recorder.summary(), server_lag, generator_lag, idle_probe, wall_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Chainlit app over Socket.IO")
+    parser.add_argument("--url", help="running Chainlit server; by default one is started against the stub backend")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which sessions connect")
+    parser.add_argument("--rate", type=float, default=0.2, help="actions per second per session (Poisson)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("text=6,image=2,audio=1,settings=1"))
+    parser.add_argument("--timeout", type=float, default=120, help="seconds to wait for each action")
+    parser.add_argument("--audio-chunk-interval", type=float, default=0.1, help="seconds between audio chunks")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=500)
+    parser.add_argument("--cassette", help="replay recorded traffic instead of the stub")
+    parser.add_argument("--replay-speed", type=float, default=1.0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    fixtures_dir = tempfile.mkdtemp(prefix="tkm-load-")
+    images = []
+    for path, mime in (
+        (make_image_fixture(fixtures_dir, "jpg", (1512, 2016)), "image/jpeg"),
+        (make_image_fixture(fixtures_dir, "png", (1512, 2016)), "image/png"),
+    ):
+        with open(path, "rb") as image_file:
+            images.append((os.path.basename(path), image_file.read(), mime))
+    fixtures = {
+        "images": images,
+        "audio": make_audio_fixture(),
+    }
+
+    processes = []
+    log_path = os.path.join(fixtures_dir, "server.log")
+    with open(log_path, "w") as log_file:
+        try:
+            if args.url:
+                url = args.url.rstrip("/")
+            else:
+                print(f"Starting the stub backend and Chainlit (log: {log_path})...", file=sys.stderr)
+                url, processes = start_backend(args, log_file)
+            print(f"Running {args.sessions} sessions against {url} for {args.duration:.0f}s...", file=sys.stderr)
+            results = asyncio.run(run(args, url, fixtures))
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait(timeout=10)
+
+    rows, server_lag, generator_lag, idle_probe, wall_time = results
+    print(format_report(rows, server_lag, generator_lag, idle_probe, wall_time, args.sessions))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "sessions": args.sessions,
+                "duration": wall_time,
+                "mix": args.mix,
+                "rate": args.rate,
+                "actions": rows,
+                "server_loop_lag": server_lag,
+                "idle_probe": idle_probe,
+                "generator_loop_lag": generator_lag,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
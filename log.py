@@ -0,0 +1,179 @@
+"""Structured JSON-lines logging that never blocks the event loop.
+
+The caller only filters by level, samples, truncates the fields and puts the
+record on a bounded in-memory queue; a background thread serialises it and
+writes it to stdout. When the queue is full the record is dropped and counted
+instead of waiting.
+
+    logger = get_logger("app")
+    logger.info("step_output", step=step.name, output=step.output)
+
+emits one line such as:
+
+    {"ts": "2024-10-01T12:00:00.123Z", "level": "info", "logger": "tkm.app", "event": "step_output", ...}
+"""
+import atexit
+from datetime import datetime, timezone
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fracción de registros debug/info que se escriben; warnings y errores se escriben siempre
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+# Fracción por evento, p. ej. "step_output=0.1,streaming_stats=0.5"
+LOG_SAMPLE_RATES = {
+    event.strip(): float(rate)
+    for event, _, rate in (item.partition("=") for item in os.getenv("LOG_SAMPLE_RATES", "").split(","))
+    if event.strip() and rate
+}
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "500"))  # Respuestas y transcripciones largas
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+_PLAIN_TYPES = (str, int, float, bool, type(None))
+
+
+def truncate(value, max_chars=LOG_MAX_FIELD_CHARS):
+    """Cut long strings to max_chars, noting how many characters were left out."""
+    if not isinstance(value, str):
+        value = repr(value)
+    if max_chars and len(value) > max_chars:
+        return f"{value[:max_chars]}... [{len(value) - max_chars} more chars]"
+    return value
+
+
+def _prepare_field(value):
+    if isinstance(value, _PLAIN_TYPES) and not isinstance(value, str):
+        return value
+    # Objetos arbitrarios se convierten ya, para no serializar un estado que cambia después
+    return truncate(value)
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, event and the record's fields."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds")[:-6] + "Z",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exc"] = truncate(self.formatException(record.exc_info), LOG_MAX_FIELD_CHARS * 4)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of waiting."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Sin formatear aquí: el JSON se genera en el hilo del listener
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.dropped:
+                self.queue.put_nowait(self._dropped_record())
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _dropped_record(self):
+        record = logging.LogRecord("tkm.log", logging.WARNING, __file__, 0, "log_records_dropped", None, None)
+        record.fields = {"count": self.dropped}
+        return record
+
+
+_root = logging.getLogger("tkm")
+_root.propagate = False  # No duplicar en los handlers de Chainlit o uvicorn
+_root.setLevel(LOG_LEVEL)
+_handler = None
+_listener = None
+_listener_pid = None
+_start_lock = threading.Lock()
+
+
+def _start():
+    """Start the writer thread for this process (image workers get their own)."""
+    global _handler, _listener, _listener_pid
+    with _start_lock:
+        if _listener_pid == os.getpid():
+            return
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JSONFormatter())
+        if _handler is not None:
+            _root.removeHandler(_handler)
+        _handler = NonBlockingQueueHandler(log_queue)
+        _root.addHandler(_handler)
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+
+def flush():
+    """Write every queued record and stop the writer thread; logging restarts on next use."""
+    global _listener_pid
+    with _start_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            _listener.stop()
+            _listener_pid = None
+
+
+def _reset_after_fork():
+    # El hilo escritor no sobrevive al fork; el hijo crea su propia cola al registrar
+    global _listener_pid, _start_lock
+    _listener_pid = None
+    _start_lock = threading.Lock()
+
+
+atexit.register(flush)
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class StructuredLogger:
+    """Logger taking an event name plus keyword fields: logger.info("event", key=value)."""
+
+    def __init__(self, name):
+        self._logger = _root.getChild(name)
+
+    def _log(self, level, event, exc_info, fields):
+        if not self._logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING:
+            rate = LOG_SAMPLE_RATES.get(event, LOG_SAMPLE_RATE)
+            if rate < 1 and random.random() >= rate:
+                return
+        if _listener_pid != os.getpid():
+            _start()
+        self._logger.log(
+            level, event, exc_info=exc_info, extra={"fields": {k: _prepare_field(v) for k, v in fields.items()}}
+        )
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, None, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, None, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, None, fields)
+
+    def error(self, event, exc_info=None, **fields):
+        self._log(logging.ERROR, event, exc_info, fields)
+
+
+def get_logger(name):
+    return StructuredLogger(name)
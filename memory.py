@@ -0,0 +1,119 @@
+from collections import deque
+
+# Ventana de contexto (tokens) de cada modelo de Groq
+MODEL_CONTEXT_WINDOWS = {
+    "llama-3.1-70b-versatile": 131072,
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "mixtral-8x7b-32768": 32768,
+    "gemma-7b-it": 8192,
+    "gemma2-9b-it": 8192,
+    "llama-3.2-11b-vision-preview": 8192,
+    "llava-v1.5-7b-4096-preview": 4096,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+RESPONSE_TOKEN_RESERVE = 1024  # Tokens reservados para la respuesta del modelo
+MESSAGE_TOKEN_OVERHEAD = 4  # Tokens extra por mensaje (rol y separadores)
+
+
+def estimate_tokens(text):
+    """Cheap local token estimate (~4 characters per token), no tokenizer needed."""
+    return max(1, len(text or "") // 4)
+
+
+def history_budget(model_id):
+    """Tokens of history that fit in the model's context window, leaving room for the answer."""
+    window = MODEL_CONTEXT_WINDOWS.get(model_id, DEFAULT_CONTEXT_WINDOW)
+    return max(window - RESPONSE_TOKEN_RESERVE, RESPONSE_TOKEN_RESERVE)
+
+
+def fit_messages(messages, model_id):
+    """Drop the oldest messages until the rest fit the budget of model_id.
+
+    The last message (the question) is always kept and the result never starts with
+    an assistant turn. Used when a request fails over to a model with a smaller
+    context window than the one the history was trimmed for; the stored history is
+    not changed.
+    """
+    budget = history_budget(model_id)
+    total = 0
+    start = len(messages)
+    # Se recorre desde el final hasta que el siguiente mensaje ya no cabe
+    while start > 0:
+        content = messages[start - 1]["content"]
+        tokens = (estimate_tokens(content) if isinstance(content, str) else 0) + MESSAGE_TOKEN_OVERHEAD
+        if start < len(messages) and total + tokens > budget:
+            break
+        total += tokens
+        start -= 1
+    while start < len(messages) - 1 and messages[start]["role"] == "assistant":
+        start += 1
+    return messages[start:]
+
+
+class ConversationMemory:
+    """Sliding window of chat turns kept within a per-model token budget.
+
+    Every message is measured once when it is added and a running total is kept,
+    so trimming only pops the oldest turns instead of re-counting the history.
+    A question and its answer are stored together by add_exchange() once the answer
+    arrives, so concurrent exchanges (several attachments) never interleave.
+    """
+
+    def __init__(self):
+        self.turns = deque()
+        self.total_tokens = 0
+
+    def add(self, role, content):
+        tokens = estimate_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+        self.turns.append(({"role": role, "content": content}, tokens))
+        self.total_tokens += tokens
+
+    def add_user(self, content):
+        self.add("user", content)
+
+    def add_assistant(self, content):
+        if content:
+            self.add("assistant", content)
+
+    def add_exchange(self, user_content, assistant_content):
+        self.add_user(user_content)
+        self.add_assistant(assistant_content)
+
+    def _pop_oldest(self):
+        _, tokens = self.turns.popleft()
+        self.total_tokens -= tokens
+
+    def trim(self, budget):
+        # Siempre se conserva el último mensaje, aunque supere el presupuesto
+        while self.total_tokens > budget and len(self.turns) > 1:
+            self._pop_oldest()
+        # La historia no debe empezar con una respuesta del asistente
+        while len(self.turns) > 1 and self.turns[0][0]["role"] == "assistant":
+            self._pop_oldest()
+
+    def messages(self, model_id):
+        """Return the history that fits the budget of model_id, dropping the oldest turns."""
+        self.trim(history_budget(model_id))
+        return [message for message, _ in self.turns]
+
+    def exchange_messages(self, model_id, content):
+        """History that fits the budget of model_id followed by a new user turn.
+
+        The turn is not stored: pass it to add_exchange() together with the answer.
+        """
+        budget = history_budget(model_id) - estimate_tokens(content) - MESSAGE_TOKEN_OVERHEAD
+        self.trim(max(budget, 0))
+        # Si la pregunta sola supera el presupuesto se envía sin historia
+        history = [message for message, _ in self.turns] if self.total_tokens <= budget else []
+        while history and history[0]["role"] == "assistant":
+            history.pop(0)
+        return history + [{"role": "user", "content": content}]
+
+    def prompt_tokens(self, content):
+        """Tokens of the stored history plus a new user turn, for auto routing."""
+        return self.total_tokens + estimate_tokens(content) + MESSAGE_TOKEN_OVERHEAD
+
+    def clear(self):
+        self.turns.clear()
+        self.total_tokens = 0
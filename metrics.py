@@ -0,0 +1,199 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+from log import get_logger
+
+logger = get_logger("metrics")
+
+# Endpoint de métricas en formato Prometheus, en un puerto junto al de Chainlit
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8001"))
+
+# Segundos: desde una lectura de caché hasta una respuesta larga del agente
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in [*zip(names, values, strict=True), *extra]]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with labels, safe to update from worker threads."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _format_labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Value that goes up and down, such as a queue depth."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram:
+    """Histogram with labels, exposed as cumulative _bucket series plus _sum and _count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, series in self._values.items():
+                for bound, count in zip(self.buckets, series["buckets"], strict=True):
+                    samples.append((f"{self.name}_bucket", _format_labels(self.labelnames, key, [("le", bound)]), count))
+                samples.append(
+                    (f"{self.name}_bucket", _format_labels(self.labelnames, key, [("le", "+Inf")]), series["count"])
+                )
+                samples.append((f"{self.name}_sum", _format_labels(self.labelnames, key), series["sum"]))
+                samples.append((f"{self.name}_count", _format_labels(self.labelnames, key), series["count"]))
+        return samples
+
+
+STEP_DURATION = Histogram(
+    "tkm_step_duration_seconds", "Duration of Chainlit steps.", ["step", "model"]
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "tkm_time_to_first_token_seconds", "Time from sending a streamed completion to its first token.", ["model"]
+)
+PROMPT_TOKENS = Counter("tkm_prompt_tokens_total", "Prompt tokens reported by Groq.", ["model"])
+COMPLETION_TOKENS = Counter("tkm_completion_tokens_total", "Completion tokens reported by Groq.", ["model"])
+CACHE_LOOKUPS = Counter(
+    "tkm_cache_lookups_total", "Cache lookups by cache and result (hit or miss).", ["cache", "result"]
+)
+UPLOADED_BYTES = Counter("tkm_uploaded_bytes_total", "Request bytes sent to Groq.", ["endpoint"])
+GROQ_REQUESTS = Counter("tkm_groq_requests_total", "Groq API responses by endpoint and status code.", ["endpoint", "status"])
+IMAGE_QUEUE_DEPTH = Gauge("tkm_image_queue_depth", "Image jobs submitted to the process pool and not finished.")
+ERRORS = Counter("tkm_errors_total", "Errors shown to the user, by step and error type.", ["step", "error"])
+
+REGISTRY = [
+    STEP_DURATION, TIME_TO_FIRST_TOKEN, PROMPT_TOKENS, COMPLETION_TOKENS,
+    CACHE_LOOKUPS, UPLOADED_BYTES, GROQ_REQUESTS, IMAGE_QUEUE_DEPTH, ERRORS,
+]
+
+
+def record_cache_lookup(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def record_token_usage(model_id, prompt_tokens, completion_tokens):
+    PROMPT_TOKENS.inc(prompt_tokens or 0, model=model_id)
+    COMPLETION_TOKENS.inc(completion_tokens or 0, model=model_id)
+
+
+def record_error(step, error):
+    ERRORS.inc(step=step, error=type(error).__name__ if isinstance(error, BaseException) else error)
+
+
+def render_metrics():
+    """Every metric in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name}{labels} {value}" for name, labels, value in metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+def _endpoint(request):
+    # /openai/v1/chat/completions -> chat/completions
+    return request.url.path.split("/v1/", 1)[-1]
+
+
+async def metrics_request_hook(request):
+    """httpx request hook: count the bytes uploaded to Groq (prompts, images, audio)."""
+    UPLOADED_BYTES.inc(int(request.headers.get("content-length") or 0), endpoint=_endpoint(request))
+
+
+async def metrics_response_hook(response):
+    """httpx response hook: count Groq responses by status code."""
+    GROQ_REQUESTS.inc(endpoint=_endpoint(response.request), status=response.status_code)
+
+
+METRICS_EVENT_HOOKS = {
+    "request": [metrics_request_hook],
+    "response": [metrics_response_hook],
+}
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Sin una línea de log por cada scrape
+
+
+_metrics_server = None
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serve /metrics from a background thread, so scrapes never touch the event loop.
+
+    Safe to call more than once; returns the server, or None if the port is taken.
+    """
+    global _metrics_server
+    if _metrics_server is None:
+        try:
+            _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            logger.warning("metrics_server_not_started", host=host, port=port, error=str(e))
+            return None
+        _metrics_server.daemon_threads = True
+        threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+        logger.info("metrics_server_started", url=f"http://{host}:{port}/metrics")
+    return _metrics_server
@@ -0,0 +1,189 @@
+import asyncio
+import contextvars
+import json
+import os
+import re
+import time
+from log import get_logger
+from memory import estimate_tokens
+from metrics import METRICS_EVENT_HOOKS
+
+logger = get_logger("rate_limit")
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+
+# Límites (RPM, TPM) del plan gratuito de Groq; las cabeceras de cada respuesta los ajustan
+MODEL_RATE_LIMITS = {
+    "llama-3.1-70b-versatile": (30, 6000),
+    "llama3-70b-8192": (30, 6000),
+    "llama3-8b-8192": (30, 30000),
+    "mixtral-8x7b-32768": (30, 5000),
+    "gemma-7b-it": (30, 15000),
+    "gemma2-9b-it": (30, 15000),
+    "llama-3.2-11b-vision-preview": (30, 7000),
+    "llava-v1.5-7b-4096-preview": (30, 30000),
+    "whisper-large-v3": (20, None),
+    "distil-whisper-large-v3-en": (20, None),
+}
+DEFAULT_RATE_LIMIT = (30, 6000)
+# Presupuesto de latencia de la llamada en curso (resilience.LatencyBudget); la espera en cola no cuenta
+current_latency_budget = contextvars.ContextVar("current_latency_budget", default=None)
+COMPLETION_TOKEN_ESTIMATE = 256  # Tokens de respuesta supuestos si no se indica max_tokens
+IMAGE_TOKEN_ESTIMATE = 1000
+
+
+def parse_duration(value):
+    """Parse Groq reset durations such as "7.66s", "120ms" or "2m59.56s" into seconds."""
+    if not value:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+
+class TokenBucket:
+    def __init__(self, capacity, per_minute):
+        self.capacity = capacity
+        self.rate = per_minute / 60.0
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        self.refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+class ModelRateLimiter:
+    """Requests-per-minute and tokens-per-minute buckets for one model.
+
+    acquire() queues callers in arrival order until both buckets have room. The
+    buckets are corrected from the x-ratelimit-* headers of every response, and a
+    429 or an exhausted daily quota pauses the model until the reset time.
+    """
+
+    def __init__(self, rpm, tpm=None):
+        self.requests = TokenBucket(rpm, rpm)
+        self.tokens = TokenBucket(tpm, tpm) if tpm else None
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _wait_time(self, tokens):
+        wait = max(self.paused_until - time.monotonic(), self.requests.wait_time(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    async def acquire(self, tokens=0):
+        async with self.lock:
+            wait = self._wait_time(tokens)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._wait_time(tokens)
+            self.requests.level -= 1
+            if self.tokens is not None:
+                self.tokens.level -= min(tokens, self.tokens.capacity)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers, status_code=200):
+        limit_tokens = headers.get("x-ratelimit-limit-tokens")
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if self.tokens is not None and limit_tokens and remaining_tokens:
+            self.tokens.capacity = int(limit_tokens)
+            self.tokens.rate = int(limit_tokens) / 60.0
+            self.tokens.refill()
+            self.tokens.level = min(self.tokens.level, float(remaining_tokens))
+        # x-ratelimit-*-requests es la cuota diaria: si se agota, esperar al reinicio
+        if headers.get("x-ratelimit-remaining-requests") == "0":
+            self.pause(parse_duration(headers.get("x-ratelimit-reset-requests")))
+        if status_code == 429:
+            retry_after = parse_duration(headers.get("retry-after")) or 1.0
+            logger.warning("rate_limit_hit", retry_after=round(retry_after, 1))
+            self.pause(retry_after)
+
+
+_limiters = {}
+
+
+def get_limiter(model_id):
+    limiter = _limiters.get(model_id)
+    if limiter is None:
+        rpm, tpm = MODEL_RATE_LIMITS.get(model_id, DEFAULT_RATE_LIMIT)
+        limiter = ModelRateLimiter(rpm, tpm)
+        _limiters[model_id] = limiter
+    return limiter
+
+
+def estimate_request_tokens(body):
+    tokens = body.get("max_tokens") or COMPLETION_TOKEN_ESTIMATE
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += estimate_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    tokens += estimate_tokens(part.get("text"))
+                else:
+                    tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+
+def _describe_request(request):
+    """Return (model_id, estimated_tokens) for a Groq API request."""
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("application/json"):
+        body = json.loads(request.content or b"{}")
+        return body.get("model"), estimate_request_tokens(body)
+    if content_type.startswith("multipart/form-data"):
+        match = re.search(rb'name="model"\r\n\r\n([^\r\n]+)', request.read())
+        if match:
+            return match.group(1).decode("utf-8"), 0
+    return None, 0
+
+
+async def rate_limit_request_hook(request):
+    """httpx request hook: wait for the model's quota before the request goes out."""
+    if not RATE_LIMIT_ENABLED:
+        return
+    model_id, tokens = _describe_request(request)
+    if model_id:
+        request.extensions["rate_limit_model"] = model_id
+        budget = current_latency_budget.get()
+        if budget is not None:
+            budget.pause()
+        try:
+            await get_limiter(model_id).acquire(tokens)
+        finally:
+            if budget is not None:
+                budget.resume()
+
+
+async def rate_limit_response_hook(response):
+    """httpx response hook: feed the x-ratelimit-* headers back into the model's buckets."""
+    model_id = response.request.extensions.get("rate_limit_model")
+    if model_id:
+        get_limiter(model_id).update_from_headers(response.headers, response.status_code)
+
+
+RATE_LIMIT_EVENT_HOOKS = {
+    "request": [rate_limit_request_hook],
+    "response": [rate_limit_response_hook],
+}
+
+# Hooks de todos los clientes HTTP de Groq (app y agente): el limitador y luego las métricas de tráfico
+GROQ_EVENT_HOOKS = {
+    event: RATE_LIMIT_EVENT_HOOKS[event] + METRICS_EVENT_HOOKS[event] for event in ("request", "response")
+}
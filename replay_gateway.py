@@ -0,0 +1,236 @@
+"""Record/replay gateway for Groq, Whisper and Tavily traffic.
+
+In record mode the gateway forwards every request to the real APIs and appends
+the response, with its timing, to a gzip JSON-lines cassette. In replay mode it
+answers from the cassette without any network access, either with the
+original timing or time-compressed with --speed.
+
+    python replay_gateway.py record --cassette traffic.jsonl.gz --port 8766
+    python replay_gateway.py replay --cassette traffic.jsonl.gz --port 8766 --speed 4
+
+Point the app at the gateway with the same variables as stub_server.py:
+GROQ_BASE_URL, GROQ_API_BASE and TAVILY_API_URL. API keys and request bodies
+are never written to the cassette; requests are matched by a hash of their
+content.
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+import gzip
+import hashlib
+import json
+import os
+import time
+import httpx
+from starlette.applications import Starlette
+from starlette.datastructures import UploadFile
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+import uvicorn
+from stub_server import STUB_KEEPALIVE_TIMEOUT, BackgroundServer
+
+GROQ_UPSTREAM_URL = os.getenv("GROQ_UPSTREAM_URL", "https://api.groq.com")
+TAVILY_UPSTREAM_URL = os.getenv("TAVILY_UPSTREAM_URL", "https://api.tavily.com")
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "120"))
+
+# Campos que no forman parte de la huella de la petición ni se guardan
+REDACTED_FIELDS = {"api_key"}
+# Cabeceras que no se reenvían al servidor real
+HOP_BY_HOP_HEADERS = {"host", "content-length", "connection", "accept-encoding", "transfer-encoding"}
+# Cabeceras de respuesta que se guardan en el cassette
+RECORDED_HEADER_PREFIXES = ("content-type", "retry-after", "x-ratelimit-")
+
+
+async def describe_request(request, body):
+    """Return (key, endpoint) for a request: a content hash and a coarser (path, model, stream) bucket."""
+    content_type = request.headers.get("content-type", "")
+    model, stream = None, False
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        fields = []
+        for name, value in form.multi_items():
+            if isinstance(value, UploadFile):
+                value = hashlib.sha256(await value.read()).hexdigest()
+            elif name == "model":
+                model = value
+            fields.append([name, value])
+        await form.close()
+        payload = json.dumps(sorted(fields))
+    else:
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            data = body.decode("utf-8", "replace")
+        if isinstance(data, dict):
+            model, stream = data.get("model"), bool(data.get("stream"))
+            data = {k: v for k, v in data.items() if k not in REDACTED_FIELDS}
+        payload = json.dumps(data, sort_keys=True)
+    path = request.url.path
+    key = hashlib.sha256(f"{request.method} {path}\n{payload}".encode("utf-8")).hexdigest()
+    return key, f"{request.method} {path} {model} {'stream' if stream else 'plain'}"
+
+
+class Cassette:
+    """Recorded exchanges, appended to and read from a gzip JSON-lines file.
+
+    match() returns the recordings of an identical request in turn; when there is
+    none (and strict is off) it cycles through the recordings of the same endpoint
+    and model, so replay still reproduces the latency profile for new prompts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self._by_key = defaultdict(list)
+        self._by_endpoint = defaultdict(list)
+        self._cursors = defaultdict(int)
+        self._write_lock = asyncio.Lock()
+        if os.path.exists(path):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._index(json.loads(line))
+
+    def _index(self, entry):
+        self.entries.append(entry)
+        self._by_key[entry["key"]].append(entry)
+        self._by_endpoint[entry["endpoint"]].append(entry)
+
+    def _next(self, bucket, entries):
+        entry = entries[self._cursors[bucket] % len(entries)]
+        self._cursors[bucket] += 1
+        return entry
+
+    def match(self, key, endpoint, strict=False):
+        """Return (entry, exact) or (None, False)."""
+        if self._by_key.get(key):
+            return self._next(key, self._by_key[key]), True
+        if not strict and self._by_endpoint.get(endpoint):
+            return self._next(endpoint, self._by_endpoint[endpoint]), False
+        return None, False
+
+    def _write(self, entry):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # Cada escritura añade un miembro gzip; gzip.open los lee todos seguidos
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    async def append(self, entry):
+        async with self._write_lock:
+            self._index(entry)
+            await asyncio.to_thread(self._write, entry)
+
+
+def upstream_url(path):
+    return (GROQ_UPSTREAM_URL if path.startswith("/openai/") else TAVILY_UPSTREAM_URL) + path
+
+
+def create_gateway_app(mode, cassette, speed=1.0, strict=False):
+    """ASGI app that records to or replays from cassette.
+
+    speed divides every recorded delay (2 = twice as fast); 0 replays without delays.
+    """
+    stats = {"recorded": 0, "exact_matches": 0, "endpoint_matches": 0, "misses": 0}
+    http_client = httpx.AsyncClient(timeout=UPSTREAM_TIMEOUT) if mode == "record" else None
+
+    async def record(request: Request):
+        start_time = time.perf_counter()
+        body = await request.body()
+        key, endpoint = await describe_request(request, body)
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+        url = upstream_url(request.url.path)
+        if request.url.query:
+            url += f"?{request.url.query}"
+        try:
+            response = await http_client.send(
+                http_client.build_request(request.method, url, headers=headers, content=body), stream=True
+            )
+        except httpx.HTTPError as e:
+            return JSONResponse({"error": {"message": f"Upstream request failed: {e}", "type": "gateway_error"}}, 502)
+
+        response_headers = {
+            k: v for k, v in response.headers.items() if k.lower().startswith(RECORDED_HEADER_PREFIXES)
+        }
+        entry = {
+            "key": key,
+            "endpoint": endpoint,
+            "status": response.status_code,
+            "headers": response_headers,
+            "ttfb": round(time.perf_counter() - start_time, 4),
+            "chunks": [],
+        }
+
+        async def relay():
+            try:
+                async for data in response.aiter_bytes():
+                    offset = round(time.perf_counter() - start_time, 4)
+                    entry["chunks"].append([offset, data.decode("utf-8", "surrogateescape")])
+                    yield data
+            finally:
+                await response.aclose()
+                await cassette.append(entry)
+                stats["recorded"] += 1
+
+        return StreamingResponse(relay(), status_code=response.status_code, headers=response_headers)
+
+    async def replay(request: Request):
+        start_time = time.perf_counter()
+        body = await request.body()
+        key, endpoint = await describe_request(request, body)
+        entry, exact = cassette.match(key, endpoint, strict)
+        if entry is None:
+            stats["misses"] += 1
+            print(f"Replay miss: {endpoint}")
+            return JSONResponse({"error": {"message": f"No recording for {endpoint}", "type": "replay_miss"}}, 404)
+        stats["exact_matches" if exact else "endpoint_matches"] += 1
+
+        async def wait_until(offset):
+            if speed:
+                delay = offset / speed - (time.perf_counter() - start_time)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+        async def chunks():
+            for offset, text in entry["chunks"]:
+                await wait_until(offset)
+                yield text.encode("utf-8", "surrogateescape")
+
+        await wait_until(entry["ttfb"])
+        return StreamingResponse(chunks(), status_code=entry["status"], headers=entry["headers"])
+
+    async def get_stats(_request: Request):
+        return JSONResponse(stats)
+
+    handler = record if mode == "record" else replay
+    app = Starlette(routes=[
+        Route("/gateway/stats", get_stats, methods=["GET"]),
+        Route("/{path:path}", handler, methods=["GET", "POST"]),
+    ])
+    app.state.stats = stats
+    return app
+
+
+class GatewayServer(BackgroundServer):
+    """The record/replay gateway running in a background thread."""
+
+    def __init__(self, mode, cassette_path, speed=1.0, strict=False, host="127.0.0.1", port=0):
+        self.cassette = Cassette(cassette_path)
+        super().__init__(create_gateway_app(mode, self.cassette, speed, strict), host, port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record or replay Groq, Whisper and Tavily traffic")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--cassette", required=True, help="gzip JSON-lines file to append to or replay from")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--speed", type=float, default=1.0, help="replay time compression (0 = no delays)")
+    parser.add_argument("--strict", action="store_true", help="only replay recordings of identical requests")
+    args = parser.parse_args()
+    cassette = Cassette(args.cassette)
+    print(f"{args.mode.title()}ing on http://{args.host}:{args.port} ({len(cassette.entries)} recorded exchanges)")
+    uvicorn.run(
+        create_gateway_app(args.mode, cassette, args.speed, args.strict),
+        host=args.host, port=args.port, log_level="warning", timeout_keep_alive=STUB_KEEPALIVE_TIMEOUT,
+    )
@@ -0,0 +1,350 @@
+import asyncio
+from collections import deque
+import os
+import random
+import time
+import groq
+from log import get_logger
+from rate_limit import current_latency_budget, parse_duration
+
+logger = get_logger("resilience")
+
+# Reintentos con backoff exponencial y jitter
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "8"))
+
+# Peticiones duplicadas (hedging) cuando la primera tarda más que el p95 observado
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.2
+
+
+class LatencyTracker:
+    """Rolling window of recent call latencies per key (usually the model id)."""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+
+    def record(self, key, seconds):
+        self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def quantile(self, key, q):
+        samples = self._samples.get(key)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+latency_tracker = LatencyTracker()
+
+
+def is_retryable(error):
+    """Connection resets, timeouts, 429s and 5xx responses are safe to retry."""
+    if isinstance(error, (groq.APIConnectionError, groq.RateLimitError, groq.InternalServerError)):
+        return True
+    return isinstance(error, groq.APIStatusError) and error.status_code in (408, 409, 503)
+
+
+def retry_delay(attempt, error=None):
+    """retry-after when the server sent one, otherwise full-jitter exponential backoff."""
+    response = getattr(error, "response", None)
+    if response is not None and response.headers.get("retry-after"):
+        return min(parse_duration(response.headers["retry-after"]), RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+SLO_POLL_INTERVAL = 0.25  # Mientras la petición espera en el limitador, el reloj está parado
+
+
+class LatencyBudget:
+    """Seconds of request time left, not counting rate-limiter waits.
+
+    The rate limiter hook pauses the budget while an attempt waits for a slot;
+    with hedged or concurrent attempts it stays paused until none is waiting.
+    Pauses are passed on to parent, so one attempt's clock also stops the SLO
+    budget of the whole call. seconds may be None for a clock that only measures.
+    """
+
+    def __init__(self, seconds=None, parent=None):
+        self.seconds = seconds
+        self.parent = parent
+        self._started = time.monotonic()
+        self._paused = 0.0
+        self._pause_started = None
+        self._waiters = 0
+
+    def pause(self):
+        if self._waiters == 0:
+            self._pause_started = time.monotonic()
+        self._waiters += 1
+        if self.parent is not None:
+            self.parent.pause()
+
+    def resume(self):
+        self._waiters -= 1
+        if self._waiters == 0:
+            self._paused += time.monotonic() - self._pause_started
+        if self.parent is not None:
+            self.parent.resume()
+
+    def elapsed(self):
+        paused = self._paused
+        if self._waiters:
+            paused += time.monotonic() - self._pause_started
+        return time.monotonic() - self._started - paused
+
+    def remaining(self):
+        """Seconds left, or None while an attempt is queued in the rate limiter."""
+        if self._waiters:
+            return None
+        return self.seconds - self.elapsed()
+
+
+async def wait_within_budget(task, budget):
+    """Wait for task until budget runs out; returns False if it ran out first."""
+    while True:
+        remaining = budget.remaining()
+        timeout = SLO_POLL_INTERVAL if remaining is None else max(remaining, 0)
+        done, _ = await asyncio.wait({task}, timeout=timeout)
+        if done:
+            return True
+        remaining = budget.remaining()
+        if remaining is not None and remaining <= 0:
+            return False
+
+
+async def _timed(request_fn, key, clock=None):
+    """Await request_fn() and record its latency, leaving out the rate limiter's queue."""
+    clock = clock or LatencyBudget(parent=current_latency_budget.get())
+    token = current_latency_budget.set(clock)
+    try:
+        result = await request_fn()
+    finally:
+        current_latency_budget.reset(token)
+    latency_tracker.record(key, clock.elapsed())
+    return result
+
+
+async def _close_unused(task):
+    """Release the connection of a finished attempt whose response is not used (AsyncStream)."""
+    if task.cancelled() or task.exception() is not None:
+        return
+    close = getattr(task.result(), "close", None)
+    if close is not None:
+        try:
+            await close()
+        except Exception as e:
+            logger.warning("hedge_close_failed", error=str(e))
+
+
+async def hedged_call(request_fn, key):
+    """Send a duplicate request if the first has not answered after the p95 latency.
+
+    The hedge timer starts once the rate limiter has let the first request out, so
+    requests queued on purpose are not duplicated. The first response to arrive
+    wins; the other request is cancelled, or closed if it also succeeded. Until
+    enough latencies have been observed for key, the request is sent only once.
+    """
+    hedge_delay = latency_tracker.quantile(key, HEDGE_QUANTILE)
+    if hedge_delay is None:
+        return await _timed(request_fn, key)
+
+    clock = LatencyBudget(max(hedge_delay, HEDGE_MIN_DELAY), parent=current_latency_budget.get())
+    first = asyncio.create_task(_timed(request_fn, key, clock))
+    tasks = {first}
+    finished = []
+    try:
+        if not await wait_within_budget(first, clock):
+            logger.info("request_hedged", key=key, delay=round(hedge_delay, 2))
+            tasks.add(asyncio.create_task(_timed(request_fn, key)))
+        error = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finished.extend(done)
+            for task in done:
+                if task.exception() is None:
+                    finished.remove(task)
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Ambas respuestas pueden llegar a la vez: la que no se usa se cierra
+        for task in finished + [task for task in tasks if task.done()]:
+            await _close_unused(task)
+
+
+async def call_with_retries(request_fn, key=None, hedge=HEDGE_ENABLED, max_attempts=RETRY_MAX_ATTEMPTS):
+    """Await request_fn(), retrying retryable errors with backoff and optionally hedging.
+
+    request_fn must build a fresh request on every call (e.g. a lambda around
+    client.chat.completions.create), since it may be invoked several times.
+    """
+    for attempt in range(max_attempts):
+        try:
+            if hedge:
+                return await hedged_call(request_fn, key)
+            return await _timed(request_fn, key)
+        except Exception as e:
+            if attempt == max_attempts - 1 or not is_retryable(e):
+                raise
+            delay = retry_delay(attempt, e)
+            logger.warning("request_retry", key=key, delay=round(delay, 2), error=str(e))
+            await asyncio.sleep(delay)
+
+
+# Cadena de modelos alternativos, en orden, para cada modelo seleccionado
+FALLBACK_CHAINS = {
+    "llama-3.1-70b-versatile": ["llama3-70b-8192", "llama3-8b-8192"],
+    "llama3-70b-8192": ["llama-3.1-70b-versatile", "llama3-8b-8192"],
+    "llama3-8b-8192": ["gemma2-9b-it", "llama-3.1-70b-versatile"],
+    "mixtral-8x7b-32768": ["llama-3.1-70b-versatile"],
+    "gemma-7b-it": ["gemma2-9b-it", "llama3-8b-8192"],
+    "gemma2-9b-it": ["gemma-7b-it", "llama3-8b-8192"],
+    "llama-3.2-11b-vision-preview": ["llava-v1.5-7b-4096-preview"],
+    "llava-v1.5-7b-4096-preview": ["llama-3.2-11b-vision-preview"],
+    "whisper-large-v3": ["distil-whisper-large-v3-en"],
+    "distil-whisper-large-v3-en": ["whisper-large-v3"],
+}
+# Segundos de petición por modelo antes de pasar al siguiente, sin contar la cola del limitador.
+# Whisper tiene su propio presupuesto: una subida de audio grande tarda más que una respuesta de texto
+FAILOVER_LATENCY_SLO = float(os.getenv("FAILOVER_LATENCY_SLO", "20"))
+TRANSCRIPTION_LATENCY_SLO = float(os.getenv("TRANSCRIPTION_LATENCY_SLO", "60"))
+ENDPOINT_LATENCY_SLOS = {
+    "chat/completions": FAILOVER_LATENCY_SLO,
+    "audio/transcriptions": TRANSCRIPTION_LATENCY_SLO,
+}
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+
+class CircuitBreaker:
+    """Stops sending traffic to a model after consecutive failures.
+
+    After failure_threshold failures in a row the breaker opens for cooldown
+    seconds; then a single trial request is let through (half-open) and its
+    outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """End a call that says nothing about the model's health (cancelled, bad input)."""
+        self.trial_in_flight = False
+
+
+_breakers = {}
+
+
+def get_breaker(model_id):
+    breaker = _breakers.get(model_id)
+    if breaker is None:
+        breaker = CircuitBreaker()
+        _breakers[model_id] = breaker
+    return breaker
+
+
+def is_failover_error(error):
+    """Errors that another model may not have: outages, timeouts, slow responses, retired models."""
+    if isinstance(error, asyncio.TimeoutError) or is_retryable(error):
+        return True
+    if isinstance(error, groq.NotFoundError):
+        return True
+    return isinstance(error, groq.BadRequestError) and "decommissioned" in str(error)
+
+
+async def call_within_slo(request_fn, key, latency_slo):
+    """call_with_retries() limited to latency_slo seconds; raises asyncio.TimeoutError.
+
+    Only time after the rate limiter has granted a slot counts, so requests queued
+    on a healthy model are never mistaken for a slow model.
+    """
+    budget = LatencyBudget(latency_slo)
+    token = current_latency_budget.set(budget)
+    try:
+        task = asyncio.ensure_future(call_with_retries(request_fn, key=key))
+    finally:
+        current_latency_budget.reset(token)
+    try:
+        if not await wait_within_budget(task, budget):
+            raise asyncio.TimeoutError()
+        return task.result()
+    finally:
+        task.cancel()
+
+
+async def call_with_failover(make_request, model_id, endpoint="chat/completions", latency_slo=None):
+    """Run make_request(candidate) along model_id's fallback chain; returns (result, model used).
+
+    Each candidate gets call_with_retries() within latency_slo seconds (by default
+    the endpoint's entry in ENDPOINT_LATENCY_SLOS). Models whose circuit breaker is
+    open are skipped. Errors that are not model-specific (bad input,
+    authentication) are raised straight away.
+    """
+    if latency_slo is None:
+        latency_slo = ENDPOINT_LATENCY_SLOS.get(endpoint, FAILOVER_LATENCY_SLO)
+    last_error = None
+    for candidate in [model_id] + FALLBACK_CHAINS.get(model_id, []):
+        breaker = get_breaker(candidate)
+        if not breaker.allow():
+            logger.info("model_skipped", model=candidate, breaker_state=breaker.state)
+            continue
+        try:
+            result = await call_within_slo(
+                lambda candidate=candidate: make_request(candidate), candidate, latency_slo
+            )
+        except Exception as e:
+            if not is_failover_error(e):
+                breaker.release()
+                raise
+            breaker.record_failure()
+            last_error = e
+            logger.warning("model_failed", model=candidate, error=repr(e))
+            continue
+        except BaseException:
+            # Cancelada (stop del usuario, desconexión): libera la prueba half-open
+            breaker.release()
+            raise
+        breaker.record_success()
+        if candidate != model_id:
+            logger.warning("model_failover", model=model_id, fallback=candidate)
+        return result, candidate
+    raise last_error or RuntimeError(f"No model available for {model_id}: all circuit breakers are open")
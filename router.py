@@ -0,0 +1,46 @@
+import re
+from memory import MODEL_CONTEXT_WINDOWS, RESPONSE_TOKEN_RESERVE, estimate_tokens
+
+AUTO_MODEL_ID = "Auto"
+
+# Modelos de texto del más rápido al más lento, con su nivel de capacidad (1 = básico, 3 = razonamiento)
+ROUTABLE_MODELS = [
+    ("llama3-8b-8192", 1),
+    ("gemma2-9b-it", 1),
+    ("mixtral-8x7b-32768", 2),
+    ("llama3-70b-8192", 3),
+    ("llama-3.1-70b-versatile", 3),
+]
+
+# Peticiones que piden razonamiento, código o análisis largo
+COMPLEX_PROMPT_PATTERN = re.compile(
+    r"```|\b(code|python|javascript|sql|debug|algorithm|prove|step by step|analy[sz]e|compare|"
+    r"explain why|reason|calculate|código|analiza|compara|explica por qué|paso a paso)\b",
+    re.IGNORECASE,
+)
+LONG_PROMPT_TOKENS = 1000
+
+
+def required_tier(question, prompt_tokens):
+    if COMPLEX_PROMPT_PATTERN.search(question or ""):
+        return 3, "prompt asks for reasoning, code or analysis"
+    if prompt_tokens > LONG_PROMPT_TOKENS:
+        return 2, f"long prompt ({prompt_tokens} tokens)"
+    return 1, "short conversational prompt"
+
+
+def route_model(question, prompt_tokens=None):
+    """Pick the fastest text model whose context window and capability tier fit the request.
+
+    prompt_tokens is the estimated size of the whole prompt (history included);
+    it defaults to the size of question alone. Returns (model_id, reason).
+    """
+    if prompt_tokens is None:
+        prompt_tokens = estimate_tokens(question)
+    tier, tier_reason = required_tier(question, prompt_tokens)
+    for model_id, model_tier in ROUTABLE_MODELS:
+        window = MODEL_CONTEXT_WINDOWS[model_id]
+        if model_tier >= tier and prompt_tokens + RESPONSE_TOKEN_RESERVE <= window:
+            return model_id, f"{tier_reason}; {prompt_tokens} tokens fit the {window}-token window"
+    model_id = max(ROUTABLE_MODELS, key=lambda model: MODEL_CONTEXT_WINDOWS[model[0]])[0]
+    return model_id, f"{prompt_tokens} tokens exceed every window, using the largest one (history will be trimmed)"
@@ -0,0 +1,45 @@
+import time
+
+
+def tokens_per_second(completion_tokens, usage, generation_time):
+    """Output speed of a completion.
+
+    Groq reports the generation time measured on its servers (usage.completion_time);
+    when it is missing, the client time from the first to the last token is used.
+    """
+    completion_time = getattr(usage, "completion_time", None) or generation_time
+    return completion_tokens / completion_time if completion_tokens and completion_time > 0 else None
+
+
+async def consume_stream(stream, start_time, on_token=None):
+    """Read a streamed chat completion and measure it.
+
+    start_time is the perf_counter() value taken before the request was sent. Every
+    content delta is passed to the coroutine function on_token as it arrives.
+    Returns (stats, usage); usage is None when Groq did not report it.
+    """
+    first_token_time = None
+    chunk_count = 0
+    usage = None
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            token = chunk.choices[0].delta.content
+            if first_token_time is None:
+                first_token_time = time.perf_counter()
+            chunk_count += 1
+            if on_token is not None:
+                await on_token(token)
+        if chunk.x_groq and chunk.x_groq.usage:
+            usage = chunk.x_groq.usage
+
+    end_time = time.perf_counter()
+    first_token_time = first_token_time or end_time
+    completion_tokens = usage.completion_tokens if usage else chunk_count
+    stats = {
+        "ttft": first_token_time - start_time,
+        "total_latency": end_time - start_time,
+        "completion_tokens": completion_tokens,
+        "tokens_per_second": tokens_per_second(completion_tokens, usage, end_time - first_token_time),
+        "queue_time": getattr(usage, "queue_time", None),
+    }
+    return stats, usage
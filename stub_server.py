@@ -0,0 +1,245 @@
+"""Local stand-in for the Groq and Tavily HTTP APIs, for offline benchmarks and load tests.
+
+Run it with `python stub_server.py --port 8765` and point the app at it:
+
+    GROQ_BASE_URL=http://127.0.0.1:8765      (AsyncGroq client in app.py)
+    GROQ_API_BASE=http://127.0.0.1:8765      (ChatGroq in the Tavily agent)
+    TAVILY_API_URL=http://127.0.0.1:8765     (Tavily searches)
+
+Latency and token rate are configurable, so runs can mimic a fast or a loaded
+Groq deployment.
+"""
+import argparse
+import asyncio
+from dataclasses import dataclass
+import json
+import os
+import threading
+import time
+import uuid
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+import uvicorn
+from memory import estimate_tokens
+
+# Marcas del prompt del agente ReAct (structured chat) de LangChain
+AGENT_FORMAT_MARKER = '"action": $TOOL_NAME'
+AGENT_SCRATCHPAD_MARKER = "This was your previous work"
+# Conexiones inactivas abiertas más tiempo que GROQ_KEEPALIVE_EXPIRY del cliente, como la API real;
+# si el stub las cerrara antes, el pool de httpx podría reutilizar una conexión ya cerrada
+STUB_KEEPALIVE_TIMEOUT = 120
+FILLER_WORDS = ("Groq", "runs", "this", "model", "on", "LPU", "hardware", "with", "low", "latency.")
+
+
+@dataclass
+class StubConfig:
+    latency: float = float(os.getenv("STUB_LATENCY", "0.2"))  # Segundos hasta el primer token
+    tokens_per_second: float = float(os.getenv("STUB_TOKENS_PER_SECOND", "500"))
+    completion_tokens: int = int(os.getenv("STUB_COMPLETION_TOKENS", "120"))
+    queue_time: float = float(os.getenv("STUB_QUEUE_TIME", "0.02"))  # Informado en usage, no esperado
+    transcription_latency: float = float(os.getenv("STUB_TRANSCRIPTION_LATENCY", "0.3"))
+    search_latency: float = float(os.getenv("STUB_SEARCH_LATENCY", "0.4"))
+
+
+def _message_text(message):
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+    return content
+
+
+def _reply_text(messages, completion_tokens):
+    """Canned answer; follows the ReAct format when the request comes from the Tavily agent."""
+    prompt = " ".join(_message_text(message) for message in messages)
+    if AGENT_FORMAT_MARKER in prompt:
+        if AGENT_SCRATCHPAD_MARKER in _message_text(messages[-1]):
+            blob = {"action": "Final Answer", "action_input": "Stub answer based on the search results."}
+        else:
+            question = _message_text(messages[-1]).strip()[:200]
+            blob = {"action": "tavily_search_results_json", "action_input": {"query": question}}
+        return f"Action:\n```\n{json.dumps(blob)}\n```"
+    return " ".join(FILLER_WORDS[i % len(FILLER_WORDS)] for i in range(completion_tokens))
+
+
+def _usage(prompt_tokens, completion_tokens, config, completion_time):
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "queue_time": config.queue_time,
+        "prompt_time": config.latency,
+        "completion_time": completion_time,
+        "total_time": config.latency + completion_time,
+    }
+
+
+def create_stub_app(config=None):
+    config = config or StubConfig()
+    stats = {"chat_completions": 0, "transcriptions": 0, "searches": 0}
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["chat_completions"] += 1
+        messages = body.get("messages", [])
+        model = body.get("model", "stub")
+        words = _reply_text(messages, config.completion_tokens).split(" ")
+        prompt_tokens = sum(estimate_tokens(_message_text(message)) for message in messages)
+        completion_time = len(words) / config.tokens_per_second
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(config.latency + completion_time)
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                }],
+                "usage": _usage(prompt_tokens, len(words), config, completion_time),
+                "system_fingerprint": "stub",
+                "x_groq": {"id": completion_id},
+            })
+
+        def chunk(delta, finish_reason=None, **extra):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}],
+                **extra,
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def events():
+            await asyncio.sleep(config.latency)
+            yield chunk({"role": "assistant", "content": ""})
+            for i, word in enumerate(words):
+                await asyncio.sleep(1 / config.tokens_per_second)
+                yield chunk({"content": word if i == 0 else f" {word}"})
+            usage = _usage(prompt_tokens, len(words), config, completion_time)
+            yield chunk({}, "stop", x_groq={"id": completion_id, "usage": usage})
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def transcriptions(request: Request):
+        form = await request.form()
+        upload = form.get("file")
+        size = len(await upload.read()) if upload is not None else 0
+        await form.close()
+        stats["transcriptions"] += 1
+        await asyncio.sleep(config.transcription_latency)
+        text = f"Stub transcription of {size} bytes of audio."
+        if form.get("response_format") == "text":
+            return PlainTextResponse(text)
+        return JSONResponse({"text": text})
+
+    async def search(request: Request):
+        body = await request.json()
+        stats["searches"] += 1
+        await asyncio.sleep(config.search_latency)
+        results = [
+            {
+                "title": f"Result {i + 1} for {body.get('query', '')}",
+                "url": f"https://example.com/result-{i + 1}",
+                "content": "Stub search result content.",
+                "score": 1.0 - i * 0.1,
+                "raw_content": None,
+            }
+            for i in range(body.get("max_results", 5))
+        ]
+        return JSONResponse({
+            "query": body.get("query"),
+            "answer": None,
+            "images": [],
+            "results": results,
+            "response_time": config.search_latency,
+        })
+
+    async def get_stats(_request: Request):
+        return JSONResponse(stats)
+
+    app = Starlette(routes=[
+        Route("/openai/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/openai/v1/audio/transcriptions", transcriptions, methods=["POST"]),
+        Route("/search", search, methods=["POST"]),
+        Route("/stats", get_stats, methods=["GET"]),
+    ])
+    app.state.stats = stats
+    return app
+
+
+class BackgroundServer:
+    """Run an ASGI app with uvicorn in a background thread.
+
+    Usage: `with BackgroundServer(app) as server: ...`; server.url is the base URL.
+    """
+
+    def __init__(self, app, host="127.0.0.1", port=0):
+        self.app = app
+        self._server = uvicorn.Server(uvicorn.Config(
+            self.app, host=host, port=port, log_level="warning", timeout_keep_alive=STUB_KEEPALIVE_TIMEOUT
+        ))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.servers[0].sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        while not self._server.started:
+            if not self._thread.is_alive():
+                raise RuntimeError("Background server failed to start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class StubServer(BackgroundServer):
+    """The stub Groq/Tavily app running in a background thread."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        super().__init__(create_stub_app(config), host, port)
+
+
+if __name__ == "__main__":
+    defaults = StubConfig()
+    parser = argparse.ArgumentParser(description="Stub Groq and Tavily APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=defaults.latency, help="seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens)
+    parser.add_argument("--transcription-latency", type=float, default=defaults.transcription_latency)
+    parser.add_argument("--search-latency", type=float, default=defaults.search_latency)
+    args = parser.parse_args()
+    config = StubConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        transcription_latency=args.transcription_latency,
+        search_latency=args.search_latency,
+    )
+    print(f"Stub Groq/Tavily server on http://{args.host}:{args.port}")
+    uvicorn.run(create_stub_app(config), host=args.host, port=args.port, log_level="warning",
+                timeout_keep_alive=STUB_KEEPALIVE_TIMEOUT)
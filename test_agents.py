@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+import pytest
+from agents import SearchResultCache, normalize_query
+
+
+def test_concurrent_fetches_send_one_request():
+    cache = SearchResultCache(ttl=60)
+    calls = []
+    started = threading.Event()
+
+    def search():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)  # Las demás peticiones llegan mientras esta sigue en curso
+        return ["result"]
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.fetch("groq", search))) for _ in range(5)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [["result"]] * 5
+    assert len(calls) == 1 and cache.misses == 1
+    assert cache.fetch("groq", search) == ["result"] and len(calls) == 1
+
+
+def test_failed_fetch_is_raised_to_every_waiter_and_not_cached():
+    cache = SearchResultCache(ttl=60)
+
+    def fail():
+        raise RuntimeError("tavily down")
+
+    with pytest.raises(RuntimeError):
+        cache.fetch("groq", fail)
+    assert cache.fetch("groq", lambda: ["result"]) == ["result"]
+
+
+def test_concurrent_afetches_send_one_request():
+    cache = SearchResultCache(ttl=60)
+    calls = []
+
+    async def search():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return ["result"]
+
+    async def run():
+        return await asyncio.gather(*[cache.afetch("groq", search) for _ in range(5)])
+
+    assert asyncio.run(run()) == [["result"]] * 5
+    assert len(calls) == 1
+    assert cache.get("groq") == ["result"]
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_search():
+    cache = SearchResultCache(ttl=60)
+    calls = []
+
+    async def search():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return ["result"]
+
+    async def run():
+        first = asyncio.create_task(cache.afetch("groq", search))
+        second = asyncio.create_task(cache.afetch("groq", search))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == ["result"]
+    assert len(calls) == 1
+
+
+def test_entries_expire_after_ttl():
+    cache = SearchResultCache(ttl=0.05)
+    cache.put("groq", ["old"])
+    time.sleep(0.06)
+    assert cache.get("groq") is None
+
+
+def test_least_recently_used_entry_is_dropped():
+    cache = SearchResultCache(ttl=60, max_entries=2)
+    cache.put("a", [1])
+    cache.put("b", [2])
+    cache.get("a")
+    cache.put("c", [3])
+    assert cache.get("b") is None and cache.get("a") == [1]
+
+
+def test_equivalent_queries_share_a_key():
+    assert normalize_query("  What is  Groq? ") == normalize_query("what is groq")
@@ -0,0 +1,58 @@
+from io import BytesIO
+import pytest
+
+np = pytest.importorskip("numpy")
+av = pytest.importorskip("av")
+
+from audio import TARGET_SAMPLE_RATE, IncrementalDecoder, SpeechSegmenter, decode_to_pcm  # noqa: E402
+
+
+def speech_pcm(pattern, sample_rate=TARGET_SAMPLE_RATE):
+    """PCM alternating a tone (1) and silence (0), one pattern entry per second."""
+    t = np.arange(sample_rate) / sample_rate
+    tone = (0.3 * np.sin(2 * np.pi * 220 * t) * 32767).astype(np.int16)
+    silence = np.zeros(sample_rate, dtype=np.int16)
+    return np.concatenate([tone if speaking else silence for speaking in pattern]).tobytes()
+
+
+def webm_recording(pcm):
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    buffer = BytesIO()
+    with av.open(buffer, "w", format="webm") as container:
+        stream = container.add_stream("libopus", rate=48000)
+        stream.layout = "mono"
+        frame = av.AudioFrame.from_ndarray(samples[None, :], format="s16", layout="mono")
+        frame.sample_rate = TARGET_SAMPLE_RATE
+        for packet in stream.encode(frame):
+            container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buffer.getvalue()
+
+
+def test_short_phrases_are_merged_up_to_the_minimum_segment():
+    segmenter = SpeechSegmenter(min_segment_ms=3000)
+    segments = segmenter.feed(speech_pcm([1, 0, 1, 0, 1, 0, 1, 0]))
+    # Cuatro frases de 1 s, unidas de dos en dos sin el segundo completo de silencio entre ellas
+    assert len(segments) == 2
+    assert all(3 <= len(segment) / (2 * TARGET_SAMPLE_RATE) < 4 for segment in segments)
+    assert segmenter.flush() is None
+
+
+def test_each_phrase_is_a_segment_without_minimum():
+    segmenter = SpeechSegmenter(min_segment_ms=0)
+    assert len(segmenter.feed(speech_pcm([1, 0, 1, 0, 1, 0]))) == 3
+
+
+def test_incremental_decoder_matches_whole_decode():
+    recording = webm_recording(speech_pcm([1, 0, 1, 1, 0]))
+    decoder = IncrementalDecoder()
+    pcm = []
+    for offset in range(0, len(recording), 2048):
+        decoder.feed(recording[offset:offset + 2048])
+        pcm.append(decoder.take_pcm())
+    decoder.close()
+    decoder.join(timeout=10)
+    pcm.append(decoder.take_pcm())
+    assert decoder.error is None
+    assert b"".join(pcm) == decode_to_pcm(recording)
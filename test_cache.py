@@ -0,0 +1,60 @@
+import pytest
+import cache as cache_module
+from cache import SemanticCache, content_tokens
+
+MODEL_ID = "llama-3.1-70b-versatile"
+
+# Pares que la similitud n-gram puntúa por encima del umbral pero piden otra cosa
+NEAR_MISSES = [
+    ("Write a python function that returns the sum of a list of integers",
+     "Write a python function that returns the product of a list of integers"),
+    ("What are the pricing plans for enterprise customers in Mexico",
+     "What are the pricing plans for enterprise customers in Spain"),
+    ("How many employees does TKM have?", "How many employees does TKM have in 2023?"),
+    ("tell me about llama 3 70b", "tell me about llama 3 8b"),
+    ("is python slow", "is python not slow"),
+    # Mismas palabras en otro orden
+    ("Is Mexico bigger than Spain?", "Is Spain bigger than Mexico?"),
+    ("convert 100 usd to eur", "convert 100 eur to usd"),
+    ("Translate this sentence from English to Spanish", "Translate this sentence from Spanish to English"),
+    ("is python slower than java", "is java slower than python"),
+]
+
+PARAPHRASES = [
+    ("what is the capital of france", "What's the capital of France?"),
+    ("How do I reverse a list in python?", "how can i reverse a list in Python"),
+    ("What is Groq?", "what is groq"),
+]
+
+
+@pytest.mark.parametrize("question,other", NEAR_MISSES)
+def test_near_miss_questions_are_not_served(question, other):
+    cache = SemanticCache(max_entries=8)
+    cache.add(MODEL_ID, question, "cached answer")
+    assert cache.lookup(MODEL_ID, other) is None
+
+
+@pytest.mark.parametrize("question,other", PARAPHRASES)
+def test_paraphrases_are_served(question, other):
+    cache = SemanticCache(max_entries=8)
+    cache.add(MODEL_ID, question, "cached answer")
+    answer, similarity = cache.lookup(MODEL_ID, other)
+    assert answer == "cached answer" and similarity >= 0.85
+
+
+def test_lookup_picks_the_candidate_with_the_same_content_words(monkeypatch):
+    monkeypatch.setitem(cache_module.SEMANTIC_CACHE_THRESHOLDS, MODEL_ID, 0.75)
+    cache = SemanticCache(max_entries=8)
+    # La pregunta sobre México es la más parecida, pero solo la de España tiene las mismas palabras
+    cache.add(MODEL_ID, "What are the pricing plans for customers in Mexico", "Mexico answer")
+    cache.add(MODEL_ID, "Which pricing plans are there for customers in Spain", "Spain answer")
+    answer, _ = cache.lookup(MODEL_ID, "What are the pricing plans for customers in Spain")
+    assert answer == "Spain answer"
+
+
+def test_content_tokens_ignore_stopwords_and_plurals():
+    assert content_tokens("What are the prices of the plans?") == content_tokens("price of plan")
+
+
+def test_content_tokens_keep_word_order():
+    assert content_tokens("usd to eur") == ("usd", "eur")
@@ -0,0 +1,56 @@
+import asyncio
+from memory import MESSAGE_TOKEN_OVERHEAD, ConversationMemory, estimate_tokens, fit_messages, history_budget
+
+MODEL_ID = "llama3-8b-8192"
+
+
+def test_concurrent_exchanges_keep_question_and_answer_together():
+    memory = ConversationMemory()
+
+    async def exchange(question, delay):
+        messages = memory.exchange_messages(MODEL_ID, question)
+        await asyncio.sleep(delay)  # Otra petición escribe en la memoria mientras tanto
+        memory.add_exchange(question, f"answer to {messages[-1]['content']}")
+
+    async def main():
+        await asyncio.gather(exchange("audio question", 0.02), exchange("image question", 0))
+
+    asyncio.run(main())
+    assert [(m["role"], m["content"]) for m in memory.messages(MODEL_ID)] == [
+        ("user", "image question"),
+        ("assistant", "answer to image question"),
+        ("user", "audio question"),
+        ("assistant", "answer to audio question"),
+    ]
+
+
+def test_exchange_messages_leave_room_for_the_new_question():
+    memory = ConversationMemory()
+    for i in range(40):
+        memory.add_exchange(f"question {i} " + "x" * 800, f"answer {i} " + "y" * 800)
+    question = "z" * 4000
+    messages = memory.exchange_messages(MODEL_ID, question)
+    assert messages[-1] == {"role": "user", "content": question}
+    assert messages[0]["role"] == "user"
+    assert memory.prompt_tokens(question) <= history_budget(MODEL_ID)
+
+
+def long_history_prompt(model_id, question):
+    memory = ConversationMemory()
+    for i in range(400):
+        memory.add_exchange(f"question {i} " + "x" * 1200, f"answer {i} " + "y" * 1200)
+    return memory.exchange_messages(model_id, question)
+
+
+def test_fit_messages_cuts_the_history_to_a_smaller_window():
+    messages = long_history_prompt("llama-3.1-70b-versatile", "last question")
+    fitted = fit_messages(messages, "llama3-8b-8192")
+    assert len(fitted) < len(messages) and fitted == messages[-len(fitted):]
+    assert fitted[0]["role"] == "user" and fitted[-1]["content"] == "last question"
+    assert sum(estimate_tokens(m["content"]) + MESSAGE_TOKEN_OVERHEAD for m in fitted) <= history_budget("llama3-8b-8192")
+    assert fit_messages(messages, "llama-3.1-70b-versatile") == messages
+
+
+def test_fit_messages_keeps_the_question_when_nothing_else_fits():
+    question = {"role": "user", "content": "z" * 100000}
+    assert fit_messages([{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}, question], "llama3-8b-8192") == [question]
@@ -0,0 +1,103 @@
+import asyncio
+import time
+import httpx
+import pytest
+import rate_limit
+from metrics import GROQ_REQUESTS
+from rate_limit import GROQ_EVENT_HOOKS, ModelRateLimiter, TokenBucket, get_limiter, parse_duration
+
+
+@pytest.fixture(autouse=True)
+def isolated_limiters(monkeypatch):
+    monkeypatch.setattr(rate_limit, "_limiters", {})
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+
+
+@pytest.mark.parametrize("value,seconds", [
+    ("2m59.56s", 179.56),
+    ("7.66s", 7.66),
+    ("120ms", 0.12),
+    ("1h2m", 3720),
+    ("3", 3),
+    ("", 0),
+    (None, 0),
+])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == pytest.approx(seconds)
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(capacity=60, per_minute=60)  # 1 por segundo
+    bucket.level = 0
+    assert bucket.wait_time(3) == pytest.approx(3, abs=0.01)
+    bucket.updated -= 2  # Han pasado 2 s
+    assert bucket.wait_time(3) == pytest.approx(1, abs=0.01)
+    bucket.updated -= 3600
+    assert bucket.wait_time(3) == 0 and bucket.level == 60
+
+
+def test_token_bucket_waits_for_at_most_its_capacity():
+    bucket = TokenBucket(capacity=10, per_minute=60)
+    bucket.level = 0
+    # Una petición mayor que el cubo espera a que se llene, no para siempre
+    assert bucket.wait_time(1000) == pytest.approx(10, abs=0.01)
+
+
+def test_acquire_waits_for_the_token_bucket():
+    limiter = ModelRateLimiter(rpm=60, tpm=600)  # 10 tokens por segundo
+    limiter.tokens.level = 0
+
+    async def run():
+        start = time.perf_counter()
+        await limiter.acquire(3)
+        return time.perf_counter() - start
+
+    assert asyncio.run(run()) == pytest.approx(0.3, abs=0.1)
+    assert limiter.requests.level == pytest.approx(59, abs=0.1)
+
+
+def test_429_pauses_the_model_for_retry_after():
+    limiter = ModelRateLimiter(rpm=30, tpm=6000)
+    limiter.update_from_headers({"retry-after": "12"}, status_code=429)
+    assert limiter._wait_time(0) == pytest.approx(12, abs=0.1)
+
+
+def test_429_without_retry_after_pauses_one_second():
+    limiter = ModelRateLimiter(rpm=30, tpm=6000)
+    limiter.update_from_headers({}, status_code=429)
+    assert limiter._wait_time(0) == pytest.approx(1, abs=0.1)
+
+
+def test_exhausted_daily_quota_pauses_until_reset():
+    limiter = ModelRateLimiter(rpm=30, tpm=6000)
+    limiter.update_from_headers({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2m59.56s"})
+    assert limiter._wait_time(0) == pytest.approx(179.56, abs=0.1)
+    other = ModelRateLimiter(rpm=30, tpm=6000)
+    other.update_from_headers({"x-ratelimit-remaining-requests": "14", "x-ratelimit-reset-requests": "2m59.56s"})
+    assert other._wait_time(0) == 0
+
+
+def test_token_headers_correct_the_bucket():
+    limiter = ModelRateLimiter(rpm=30, tpm=6000)
+    limiter.update_from_headers({"x-ratelimit-limit-tokens": "20000", "x-ratelimit-remaining-tokens": "150"})
+    assert limiter.tokens.capacity == 20000
+    assert limiter.tokens.level == pytest.approx(150)
+    assert limiter.tokens.wait_time(500) == pytest.approx((500 - 150) / (20000 / 60), abs=0.01)
+
+
+def test_groq_hooks_queue_the_request_and_read_the_response():
+    def groq(_request):
+        return httpx.Response(429, headers={"retry-after": "30"}, json={"error": "rate limited"})
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(groq), event_hooks=GROQ_EVENT_HOOKS) as client:
+            await client.post("https://api.groq.com/openai/v1/chat/completions",
+                              json={"model": "llama3-8b-8192", "messages": [{"role": "user", "content": "hi"}]})
+
+    before = dict(GROQ_REQUESTS._values)
+    asyncio.run(run())
+    limiter = get_limiter("llama3-8b-8192")
+    assert limiter.requests.level == pytest.approx(limiter.requests.capacity - 1, abs=0.1)
+    assert limiter._wait_time(0) == pytest.approx(30, abs=0.1)
+    key = ("chat/completions", "429")
+    assert GROQ_REQUESTS._values[key] == before.get(key, 0) + 1
@@ -0,0 +1,213 @@
+import asyncio
+import httpx
+import pytest
+import rate_limit
+import resilience
+from memory import ConversationMemory, estimate_tokens, fit_messages, history_budget
+from rate_limit import ModelRateLimiter, rate_limit_request_hook
+from resilience import CircuitBreaker, call_with_failover, get_breaker, hedged_call
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(monkeypatch):
+    monkeypatch.setattr(resilience, "_breakers", {})
+    monkeypatch.setattr(rate_limit, "_limiters", {})
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(resilience, "FALLBACK_CHAINS", {"m": ["n"]})
+    monkeypatch.setattr(resilience, "RETRY_MAX_ATTEMPTS", 1)
+
+
+def open_breaker(breaker):
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+
+def test_breaker_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_half_open_breaker_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0)
+    open_breaker(breaker)
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_failed_trial_reopens_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=60)
+    open_breaker(breaker)
+    breaker.opened_at -= 60
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+
+def test_cancelled_trial_releases_half_open_breaker():
+    breaker = get_breaker("m")
+    breaker.cooldown = 0
+    open_breaker(breaker)
+
+    async def hang(_model_id):
+        await asyncio.sleep(60)
+
+    async def run():
+        task = asyncio.create_task(call_with_failover(hang, "m", latency_slo=30))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert breaker.allow()
+
+
+async def rate_limited_request(model_id, duration=0.05):
+    request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions",
+                            json={"model": model_id, "messages": []})
+    await rate_limit_request_hook(request)
+    await asyncio.sleep(duration)
+    return model_id
+
+
+def test_rate_limiter_wait_does_not_count_against_slo():
+    # 120 RPM con el cubo vacío: cada llamada espera 0.5 s más que la anterior
+    limiter = ModelRateLimiter(rpm=120)
+    limiter.requests.level = 0
+    rate_limit._limiters["m"] = limiter
+
+    async def run():
+        return await asyncio.gather(*[
+            call_with_failover(rate_limited_request, "m", latency_slo=0.3) for _ in range(4)
+        ])
+
+    results = asyncio.run(run())
+    assert [model_used for _, model_used in results] == ["m"] * 4
+    assert get_breaker("m").failures == 0
+
+
+def test_slow_request_fails_over_after_slo():
+    async def slow_on_m(model_id):
+        return await rate_limited_request(model_id, duration=1 if model_id == "m" else 0.01)
+
+    result, model_used = asyncio.run(call_with_failover(slow_on_m, "m", latency_slo=0.2))
+    assert model_used == "n"
+    assert get_breaker("m").failures == 1
+
+
+def test_transcriptions_use_their_own_slo(monkeypatch):
+    monkeypatch.setitem(resilience.ENDPOINT_LATENCY_SLOS, "chat/completions", 0.1)
+    monkeypatch.setitem(resilience.ENDPOINT_LATENCY_SLOS, "audio/transcriptions", 1)
+
+    async def upload(model_id):
+        await asyncio.sleep(0.3)
+        return model_id
+
+    _, model_used = asyncio.run(call_with_failover(upload, "m", endpoint="audio/transcriptions"))
+    assert model_used == "m"
+
+
+class FakeStream:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fast_history(monkeypatch):
+    """p95 de 50 ms para "m": el hedge salta tras HEDGE_MIN_DELAY."""
+    tracker = resilience.LatencyTracker()
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        tracker.record("m", 0.05)
+    monkeypatch.setattr(resilience, "latency_tracker", tracker)
+    return tracker
+
+
+def test_hedge_timer_starts_after_the_rate_limiter(fast_history):
+    limiter = ModelRateLimiter(rpm=120)
+    limiter.requests.level = 0  # La petición espera 0.5 s en el limitador
+    rate_limit._limiters["m"] = limiter
+    calls = []
+
+    async def request():
+        calls.append(1)
+        return await rate_limited_request("m")
+
+    assert asyncio.run(hedged_call(request, "m")) == "m"
+    assert len(calls) == 1
+    # La muestra de latencia no incluye la cola del limitador
+    assert max(fast_history._samples["m"]) < 0.3
+
+
+@pytest.mark.usefixtures("fast_history")
+def test_slow_request_is_hedged():
+    calls = []
+
+    async def request():
+        calls.append(1)
+        await asyncio.sleep(0.5 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    assert asyncio.run(hedged_call(request, "m")) == 2
+    assert len(calls) == 2
+
+
+@pytest.mark.usefixtures("fast_history")
+def test_unused_hedge_response_is_closed():
+    streams = []
+
+    async def run():
+        both_sent = asyncio.Event()
+
+        async def request():
+            stream = FakeStream()
+            streams.append(stream)
+            if len(streams) == 2:
+                both_sent.set()
+            await both_sent.wait()  # Las dos respuestas llegan a la vez
+            return stream
+
+        return await hedged_call(request, "m")
+
+    winner = asyncio.run(run())
+    assert len(streams) == 2 and not winner.closed
+    assert [stream.closed for stream in streams if stream is not winner] == [True]
+
+def test_fallback_gets_the_history_cut_to_its_context_window(monkeypatch):
+    monkeypatch.setattr(resilience, "FALLBACK_CHAINS", {"llama-3.1-70b-versatile": ["llama3-8b-8192"]})
+    memory = ConversationMemory()
+    for i in range(400):
+        memory.add_exchange(f"question {i} " + "x" * 1200, f"answer {i} " + "y" * 1200)
+    messages = memory.exchange_messages("llama-3.1-70b-versatile", "last question")
+    sent = {}
+
+    async def make_request(model_id):
+        # Igual que app.create_chat_completion
+        sent[model_id] = fit_messages(messages, model_id)
+        if sum(estimate_tokens(m["content"]) for m in sent[model_id]) > history_budget(model_id):
+            raise AssertionError("context_length_exceeded")  # Error que no provoca failover
+        if model_id == "llama-3.1-70b-versatile":
+            raise asyncio.TimeoutError()
+        return "answer"
+
+    result, model_used = asyncio.run(call_with_failover(make_request, "llama-3.1-70b-versatile"))
+    assert (result, model_used) == ("answer", "llama3-8b-8192")
+    assert len(sent["llama3-8b-8192"]) < len(sent["llama-3.1-70b-versatile"])
+    assert sent["llama3-8b-8192"][-1]["content"] == "last question"
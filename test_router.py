@@ -0,0 +1,38 @@
+import pytest
+from memory import MODEL_CONTEXT_WINDOWS, RESPONSE_TOKEN_RESERVE
+from router import ROUTABLE_MODELS, route_model
+
+
+@pytest.mark.parametrize("question,model_id", [
+    ("hi, how are you?", "llama3-8b-8192"),
+    ("What is the capital of France?", "llama3-8b-8192"),
+    ("Write python code that parses a CSV file", "llama3-70b-8192"),
+    ("Explain why the sky is blue, step by step", "llama3-70b-8192"),
+    ("Compara estos dos contratos", "llama3-70b-8192"),
+    ("Fix this:\n```\nprint(1\n```", "llama3-70b-8192"),
+])
+def test_route_by_capability_tier(question, model_id):
+    assert route_model(question)[0] == model_id
+
+
+def test_long_prompt_needs_a_mid_tier_model():
+    assert route_model("summarise our chat", prompt_tokens=2000)[0] == "mixtral-8x7b-32768"
+
+
+def test_prompt_that_overflows_8k_moves_to_a_larger_window():
+    # Un prompt complejo que no cabe en llama3-70b-8192 pasa al modelo de 128k
+    model_id, _ = route_model("compare these documents", prompt_tokens=8192 - RESPONSE_TOKEN_RESERVE + 1)
+    assert model_id == "llama-3.1-70b-versatile"
+    # Uno sencillo cabe antes en mixtral (32k)
+    assert route_model("summarise our chat", prompt_tokens=20000)[0] == "mixtral-8x7b-32768"
+    assert route_model("summarise our chat", prompt_tokens=40000)[0] == "llama-3.1-70b-versatile"
+
+
+def test_prompt_larger_than_every_window_uses_the_largest():
+    model_id, reason = route_model("hello", prompt_tokens=10_000_000)
+    assert model_id == max((m for m, _ in ROUTABLE_MODELS), key=MODEL_CONTEXT_WINDOWS.get)
+    assert "exceed" in reason
+
+
+def test_default_prompt_size_is_the_question():
+    assert route_model("x" * 8000)[0] == "mixtral-8x7b-32768"  # ~2000 tokens
@@ -0,0 +1,54 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from benchmark import benchmark_model
+from streaming import consume_stream, tokens_per_second
+
+
+def chunk(content=None, usage=None):
+    delta = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)], x_groq=SimpleNamespace(usage=usage))
+
+
+async def fake_stream(tokens, usage=None, delay=0.01):
+    for token in tokens:
+        await asyncio.sleep(delay)
+        yield chunk(token)
+    yield chunk(usage=usage)
+
+
+def test_server_completion_time_is_preferred():
+    usage = SimpleNamespace(completion_tokens=50, completion_time=0.1)
+    assert tokens_per_second(50, usage, generation_time=5.0) == pytest.approx(500)
+
+
+def test_client_time_is_used_without_usage():
+    assert tokens_per_second(10, None, generation_time=0.5) == pytest.approx(20)
+    assert tokens_per_second(0, None, generation_time=0.5) is None
+
+
+def test_consume_stream_passes_tokens_and_measures():
+    received = []
+
+    async def on_token(token):
+        received.append(token)
+
+    async def main():
+        return await consume_stream(fake_stream(["a", "b", "c"]), 0.0, on_token=on_token)
+
+    stats, usage = asyncio.run(main())
+    assert received == ["a", "b", "c"] and usage is None
+    assert stats["completion_tokens"] == 3 and stats["tokens_per_second"] > 0
+
+
+def test_benchmark_uses_the_same_stats_as_the_chat():
+    usage = SimpleNamespace(completion_tokens=40, completion_time=0.2, queue_time=0.01)
+
+    async def create(**_kwargs):
+        return fake_stream(["x"] * 4, usage)
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    result = asyncio.run(benchmark_model(client, "m", [{"role": "user", "content": "hi"}]))
+    assert result["error"] is None
+    assert result["tokens_per_second"] == pytest.approx(200)
+    assert result["queue_time"] == 0.01